@@ -1,61 +1,280 @@
 import random
 import os
+import json
+import math
+import heapq
+import threading
+import numpy as np
 from flask import Flask, request, jsonify
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from dataclasses import dataclass
-from datetime import datetime
 from flask_cors import CORS  # 引入flask-cors
 from flask_socketio import SocketIO, emit
 from concurrent.futures import ThreadPoolExecutor
-from coordTransform import wgs84_to_gcj02
+from service import map_partitions
+from trajectory_store import COORD_SCALE, attach_store, open_store, to_timestamp
+from taxi_catalog import SEARCH_PAGE_SIZE, load_catalog
+from streaming import wants_ndjson, ndjson_response
+from trail_codec import wants_binary, binary_response
 
 app = Flask(__name__)
 # DATA_DIR = ".\\src\\utils\\taxi_log_2008_by_id"
 DATA_DIR = "taxi_log_2008_by_id"
+EARTH_RADIUS = 6371000  # 地球半径，单位米
+# 并行加载轨迹的线程数；每次最多提交 LOAD_WINDOW 辆车，已完成的结果及时交给调用方，内存不随车辆数增长
+LOAD_THREADS = 16
+LOAD_WINDOW = 64
+# 速度异常点过滤：前后两段位移速度均超过 MAX_SPEED（米/秒）、中间不超过 OUTLIER_RUN 个点的漂移段被丢弃
+MAX_SPEED = 50
+OUTLIER_RUN = 3
+# 细节层次（LOD）金字塔各层的简化容忍度（米），按缩放级别对应的地面分辨率选层
+LOD_TOLERANCES = (2, 8, 32, 128, 512)
+LOD_FILE = "trail_lod.npz"
+LOD_META_FILE = "trail_lod.json"
+# 每个进程缓存已加载的LOD金字塔
+_trail_lods = {}
+_trail_lod_lock = threading.Lock()
 socketio = SocketIO(app, cors_allowed_origins='*')
 CORS(app)  # 启用CORS支持
 # F1
-@dataclass
+@dataclass(slots=True)
 class TrailPoint:
     """
-    表示轨迹中的一个点
+    表示轨迹中的一个点（仅按下标取单点时创建，轨迹本身保存在 TrailLine 的数组中）
     Attributes:
-        latitude: 纬度
-        longitude: 经度
-        timestamp: 时间戳
+        latitude: 纬度（GCJ02）
+        longitude: 经度（GCJ02）
+        timestamp: Unix时间戳
     """
     latitude: float
     longitude: float
-    timestamp: str
+    timestamp: float
 
-@dataclass
 class TrailLine:
     """
-    表示一辆出租车的轨迹线
+    表示一辆出租车的轨迹线，轨迹点按列保存在连续的NumPy数组中
     Attributes:
         taxi_id: 出租车ID
-        points: 轨迹点列表
+        lats: 纬度数组（GCJ02）
+        lngs: 经度数组（GCJ02）
+        epoch: 时间数组（存储中的秒数，见 trajectory_store.to_timestamp）
     """
-    taxi_id: str
-    points: List[TrailPoint]
+    __slots__ = ("taxi_id", "lats", "lngs", "epoch")
 
-def is_valid_point(lat: float, lng: float, timestamp: str) -> bool:
+    def __init__(self, taxi_id: str, lats: np.ndarray, lngs: np.ndarray, epoch: np.ndarray):
+        self.taxi_id = taxi_id
+        self.lats = lats
+        self.lngs = lngs
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def __getitem__(self, index):
+        """
+        Args:
+            index: 整数下标，或切片、布尔掩码、下标数组
+        Returns:
+            整数下标返回 TrailPoint；切片返回共享数组的视图，掩码与下标数组返回副本
+        """
+        if isinstance(index, (int, np.integer)):
+            return TrailPoint(float(self.lats[index]), float(self.lngs[index]),
+                              float(to_timestamp(self.epoch[index])))
+        return TrailLine(self.taxi_id, self.lats[index], self.lngs[index], self.epoch[index])
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """Unix时间戳数组"""
+        return to_timestamp(self.epoch)
+
+    def to_path(self) -> List[List[float]]:
+        """
+        Returns:
+            List[List[float]]: 响应中的 [[纬度, 经度, 时间戳], ...]
+        """
+        return np.column_stack((self.lats, self.lngs, self.timestamps)).tolist()
+
+def is_valid_point(lat, lng):
     """
-    验证点是否有效
+    验证点是否有效（时间格式已在导入列式存储时校验），标量与数组均可
     Args:
         lat: 纬度
         lng: 经度
-        timestamp: 时间戳
     Returns:
-        bool: 如果点在有效范围内且时间格式正确返回True，否则返回False
+        bool 或 np.ndarray: 点在有效范围内为True
     """
-    try:
-        if not (39.4 <= lat <= 41.0 and 115.7 <= lng <= 117.4):
-            return False
-        datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-        return True
-    except:
-        return False
+    return (39.4 <= lat) & (lat <= 41.0) & (115.7 <= lng) & (lng <= 117.4)
+
+def pair_speeds(epoch: np.ndarray, lats: np.ndarray, lngs: np.ndarray,
+                sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    计算各点对之间的平均速度（米/秒，等距投影近似，时间差不足1秒按1秒计）
+    Args:
+        epoch, lats, lngs: 时间（秒）与经纬度数组
+        sources: 起点下标
+        targets: 终点下标
+    Returns:
+        np.ndarray: 每个点对的速度
+    """
+    scale = math.pi / 180 * EARTH_RADIUS
+    dy = (lats[targets] - lats[sources]) * scale
+    dx = (lngs[targets] - lngs[sources]) * scale * np.cos(np.radians(lats[sources]))
+    return np.hypot(dx, dy) / np.maximum(epoch[targets] - epoch[sources], 1)
+
+def speed_outliers(epoch: np.ndarray, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """
+    标记速度异常的漂移点：两段超速位移之间不超过 OUTLIER_RUN 个点，且跳过这些点后首尾直接相连的速度正常
+    Args:
+        epoch: 时间数组（秒）
+        lats: 纬度数组
+        lngs: 经度数组
+    Returns:
+        np.ndarray: 布尔数组，漂移点为True
+    """
+    outliers = np.zeros(len(epoch), dtype=bool)
+    if len(epoch) < 3:
+        return outliers
+    points = np.arange(len(epoch))
+    # jumps[k] 表示第 jumps[k] 点到下一点的位移超速
+    jumps = np.flatnonzero(pair_speeds(epoch, lats, lngs, points[:-1], points[1:]) > MAX_SPEED)
+    # 首尾单个漂移点：只与相邻点之间超速，而相邻点之后的位移正常
+    if len(jumps) and jumps[0] == 0 and (len(jumps) == 1 or jumps[1] != 1):
+        outliers[0] = True
+    if len(jumps) and jumps[-1] == len(epoch) - 2 and (len(jumps) == 1 or jumps[-2] != len(epoch) - 3):
+        outliers[-1] = True
+    if len(jumps) < 2:
+        return outliers
+    starts, ends = jumps[:-1], jumps[1:]
+    candidates = (ends - starts <= OUTLIER_RUN) & (pair_speeds(epoch, lats, lngs, starts, ends + 1) <= MAX_SPEED)
+    # 超速位移很少，逐个处理候选区间，已作为区间终点的位移不再作为下一区间的起点
+    last_end = -1
+    for start, end in zip(starts[candidates].tolist(), ends[candidates].tolist()):
+        if start > last_end:
+            outliers[start + 1:end + 1] = True
+            last_end = end
+    return outliers
+
+def valid_indices(epoch: np.ndarray, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """
+    返回一辆车的有效点下标：在有效范围内（WGS84），且不是速度异常的漂移点
+    """
+    valid = np.flatnonzero(is_valid_point(lats, lngs))
+    return valid[~speed_outliers(epoch[valid], lats[valid], lngs[valid])]
+
+def cleaned_positions(store, start: int, end: int) -> np.ndarray:
+    """
+    返回 [start, end) 内有效且与前一有效点坐标不同的点在存储中的位置（与 load_taxi_data + remove_duplicate_points 一致）
+    """
+    epoch, lngs, lats = store.columns(start, end)
+    _, lngs_gcj, lats_gcj = store.gcj_columns(start, end)
+    valid = valid_indices(epoch, lats, lngs)
+    lats_gcj, lngs_gcj = lats_gcj[valid], lngs_gcj[valid]
+    changed = np.concatenate(([True], (lats_gcj[1:] != lats_gcj[:-1]) | (lngs_gcj[1:] != lngs_gcj[:-1])))
+    return valid[changed] + start
+
+def lod_partition(args):
+    """
+    为 [start, end) 区间内的车辆计算各层简化结果（在子进程中执行）
+    Returns:
+        (positions, counts): 每层保留点位置的拼接数组，以及 (层数, 车辆数) 的每车保留点数
+    """
+    store_dir, start, end = args
+    store = attach_store(store_dir)
+    lo, hi = np.searchsorted(store.offsets, [start, end])
+    bounds = store.offsets[lo:hi + 1]
+    positions = [[] for _ in LOD_TOLERANCES]
+    counts = np.zeros((len(LOD_TOLERANCES), len(bounds) - 1), dtype=np.int64)
+    for i, (taxi_start, taxi_end) in enumerate(zip(bounds[:-1].tolist(), bounds[1:].tolist())):
+        kept = cleaned_positions(store, taxi_start, taxi_end)
+        if not len(kept):
+            continue
+        ys, xs = to_local_meters(store.lat_gcj[kept] / COORD_SCALE, store.lng_gcj[kept] / COORD_SCALE)
+        for level, tolerance in enumerate(LOD_TOLERANCES):
+            level_positions = kept[douglas_peucker_indices(ys, xs, tolerance)]
+            positions[level].append(level_positions)
+            counts[level, i] = len(level_positions)
+    return ([np.concatenate(level).astype(np.int64) if level else np.zeros(0, dtype=np.int64) for level in positions],
+            counts)
+
+def load_trail_lod(store):
+    """
+    读取LOD金字塔，不存在或与存储不一致时重新计算并落盘（每个进程只加载一次）
+    Returns:
+        dict: {"positions": [每层保留点位置], "offsets": (层数, 车辆数+1) 每车在各层中的区间}
+    """
+    with _trail_lod_lock:
+        if store.path in _trail_lods:
+            return _trail_lods[store.path]
+
+        lod_file = os.path.join(store.path, LOD_FILE)
+        meta_file = os.path.join(store.path, LOD_META_FILE)
+        expected = {"tolerances": list(LOD_TOLERANCES), "maxSpeed": MAX_SPEED, "outlierRun": OUTLIER_RUN,
+                    "source": store.meta["source"]}
+        lod = None
+        if os.path.exists(lod_file) and os.path.exists(meta_file):
+            with open(meta_file) as f:
+                if json.load(f) == expected:
+                    with np.load(lod_file) as data:
+                        lod = {"positions": [data[f"positions{level}"] for level in range(len(LOD_TOLERANCES))],
+                               "offsets": data["offsets"]}
+        if lod is None:
+            # 空存储没有区间，在本进程中计算一个空区间，得到结构相同的空金字塔
+            parts = map_partitions(lod_partition, store) or [lod_partition((store.path, 0, 0))]
+            counts = np.concatenate([part[1] for part in parts], axis=1)
+            lod = {"positions": [np.concatenate([part[0][level] for part in parts])
+                                 for level in range(len(LOD_TOLERANCES))],
+                   "offsets": np.concatenate([np.zeros((len(LOD_TOLERANCES), 1), dtype=np.int64),
+                                              np.cumsum(counts, axis=1)], axis=1)}
+            np.savez(lod_file, offsets=lod["offsets"],
+                     **{f"positions{level}": positions for level, positions in enumerate(lod["positions"])})
+            with open(meta_file, 'w') as f:
+                json.dump(expected, f)
+        _trail_lods[store.path] = lod
+        return lod
+
+def lod_level(zoom: float, latitude: float = 39.9) -> Optional[int]:
+    """
+    按地图缩放级别选择LOD层：容忍度不超过一个像素对应地面距离的最粗一层
+    Returns:
+        Optional[int]: 层号，像素分辨率比最细一层还高时返回None（使用去重后的原始轨迹）
+    """
+    meters_per_pixel = 156543.03 * math.cos(math.radians(latitude)) / 2 ** zoom
+    levels = [level for level, tolerance in enumerate(LOD_TOLERANCES) if tolerance <= meters_per_pixel]
+    return levels[-1] if levels else None
+
+def load_lod_trail(taxi_id: str, level: int) -> Optional[TrailLine]:
+    """
+    从LOD金字塔加载指定层的轨迹（已去重、已简化）
+    Returns:
+        Optional[TrailLine]: 车辆不存在或没有有效数据时返回None
+    """
+    store = open_store(DATA_DIR)
+    taxi_range = store.taxi_range(taxi_id)
+    if taxi_range is None:
+        return None
+    lod = load_trail_lod(store)
+    i = int(np.searchsorted(store.offsets, taxi_range[0], side='right')) - 1
+    positions = lod["positions"][level][lod["offsets"][level, i]:lod["offsets"][level, i + 1]]
+    if not len(positions):
+        return None
+    return TrailLine(taxi_id, store.lat_gcj[positions] / COORD_SCALE, store.lng_gcj[positions] / COORD_SCALE,
+                     store.epoch[positions].astype(np.int64))
+
+def clip_trail(trail: TrailLine, viewport: dict) -> TrailLine:
+    """
+    裁剪轨迹到视口范围，保留视口内的点及其前后各一个点，使进出视口的线段仍能画到边界
+    Args:
+        trail: 轨迹线
+        viewport: {"ltPoint": [经度, 纬度], "rbPoint": [经度, 纬度]}
+    Returns:
+        TrailLine: 裁剪后的轨迹线
+    """
+    (min_lng, max_lat), (max_lng, min_lat) = viewport["ltPoint"], viewport["rbPoint"]
+    inside = (min_lat <= trail.lats) & (trail.lats <= max_lat) & (min_lng <= trail.lngs) & (trail.lngs <= max_lng)
+    keep = inside.copy()
+    keep[1:] |= inside[:-1]
+    keep[:-1] |= inside[1:]
+    return trail[keep]
 
 def load_taxi_data(taxi_id: str) -> Optional[TrailLine]:
     """
@@ -65,120 +284,259 @@ def load_taxi_data(taxi_id: str) -> Optional[TrailLine]:
     Returns:
         Optional[TrailLine]: 如果文件存在且包含有效数据返回TrailLine对象，否则返回None
     """
-    filepath = os.path.join(DATA_DIR, f"{taxi_id}.txt")
-    if not os.path.exists(filepath):
+    store = open_store(DATA_DIR)
+    taxi_range = store.taxi_range(taxi_id)
+    if taxi_range is None:
         return None
 
-    points = []
-    with open(filepath, 'r') as file:
-        for line in file:
-            parts = line.strip().split(',')
-            if len(parts) == 4:
-                _, timestamp, lng, lat = parts
-                try:
-                    lat_f = float(lat)
-                    lng_f = float(lng)
-                    if is_valid_point(lat_f, lng_f, timestamp):
-                        points.append(TrailPoint(lat_f, lng_f, timestamp))
-                except:
-                    continue
-    return TrailLine(taxi_id=taxi_id, points=points) if points else None
-
-def remove_duplicate_points(trail: TrailLine) -> List[TrailPoint]:
-    """
-    移除轨迹中的重复点
+    # 有效范围与速度按WGS84判断，轨迹点直接使用导入时转换好的GCJ02坐标
+    epoch, lngs, lats = store.columns(*taxi_range)
+    _, lngs_gcj, lats_gcj = store.gcj_columns(*taxi_range)
+    valid = valid_indices(epoch, lats, lngs)
+    if not len(valid):
+        return None
+    return TrailLine(taxi_id, lats_gcj[valid], lngs_gcj[valid], epoch[valid])
+
+def remove_duplicate_points(trail: TrailLine) -> TrailLine:
+    """
+    移除轨迹中与前一点坐标相同的点
     Args:
         trail: 原始轨迹线
     Returns:
-        List[TrailPoint]: 去重后的轨迹点列表
+        TrailLine: 去重后的轨迹线
     """
-    if not trail.points:
-        return []
-    unique = [trail.points[0]]
-    for pt in trail.points[1:]:
-        if pt.latitude != unique[-1].latitude or pt.longitude != unique[-1].longitude:
-            unique.append(pt)
-    return unique
+    if len(trail) <= 1:
+        return trail
+    changed = np.empty(len(trail), dtype=bool)
+    changed[0] = True
+    np.not_equal(trail.lats[1:], trail.lats[:-1], out=changed[1:])
+    changed[1:] |= trail.lngs[1:] != trail.lngs[:-1]
+    return trail if changed.all() else trail[changed]
 
-def perpendicular_distance(p: TrailPoint, start: TrailPoint, end: TrailPoint) -> float:
+def perpendicular_distances(ys: np.ndarray, xs: np.ndarray, points: np.ndarray,
+                            starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
     """
-    计算点到线段的垂直距离
+    计算各点到其所在区间首尾两点连线的垂直距离
     Args:
-        p: 目标点
-        start: 线段起点
-        end: 线段终点
+        ys: 纵坐标数组（纬度或米）
+        xs: 横坐标数组（经度或米）
+        points: 点下标
+        starts: 每个点所在区间的起点下标
+        ends: 每个点所在区间的终点下标
     Returns:
-        float: 点到线段的垂直距离
+        np.ndarray: 距离数组，首尾两点重合时为到该点的直线距离
     """
-    if start.latitude == end.latitude and start.longitude == end.longitude:
-        return ((p.latitude - start.latitude) ** 2 + (p.longitude - start.longitude) ** 2) ** 0.5
-    area = abs((end.longitude - start.longitude) * (start.latitude - p.latitude) -
-               (start.longitude - p.longitude) * (end.latitude - start.latitude))
-    base = ((end.latitude - start.latitude) ** 2 + (end.longitude - start.longitude) ** 2) ** 0.5
-    return area / base
+    y, x = ys[points], xs[points]
+    y0, x0, y1, x1 = ys[starts], xs[starts], ys[ends], xs[ends]
+    area = np.abs((x1 - x0) * (y0 - y) - (x0 - x) * (y1 - y0))
+    base = ((y1 - y0) ** 2 + (x1 - x0) ** 2) ** 0.5
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(base > 0, area / base, np.sqrt((y - y0) ** 2 + (x - x0) ** 2))
 
-def douglas_peucker(points: List[TrailPoint], tolerance: float) -> List[TrailPoint]:
+def to_local_meters(lats: np.ndarray, lngs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """以轨迹平均纬度做等距投影，将经纬度换算为平面坐标（米）"""
+    scale = math.pi / 180 * EARTH_RADIUS
+    return lats * scale, lngs * scale * math.cos(math.radians(float(lats.mean())))
+
+def douglas_peucker_indices(ys: np.ndarray, xs: np.ndarray, tolerance: float) -> np.ndarray:
     """
     使用Douglas-Peucker算法简化轨迹
+    不递归、不复制子列表：按层处理所有待拆分的下标区间，同一层的全部区间一次向量化计算
     Args:
-        points: 原始轨迹点列表
-        tolerance: 简化容忍度
+        ys: 纵坐标数组
+        xs: 横坐标数组
+        tolerance: 简化容忍度（与坐标同单位）
+    Returns:
+        np.ndarray: 保留点的下标（升序）
+    """
+    n = len(ys)
+    if n <= 2:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    starts, ends = np.array([0]), np.array([n - 1])
+    while True:
+        inner = ends - starts - 1
+        starts, ends, inner = starts[inner > 0], ends[inner > 0], inner[inner > 0]
+        if not len(starts):
+            break
+        # 展开各区间的内部点
+        offsets = np.cumsum(inner) - inner
+        owner = np.repeat(np.arange(len(starts)), inner)
+        points = np.arange(len(owner)) - offsets[owner] + starts[owner] + 1
+        distances = perpendicular_distances(ys, xs, points, starts[owner], ends[owner])
+        # 每个区间距离最大的点（并列时取第一个）
+        max_distances = np.maximum.reduceat(distances, offsets)
+        first = np.minimum.reduceat(np.where(distances == max_distances[owner], np.arange(len(owner)), len(owner)),
+                                    offsets)
+        split = max_distances > tolerance
+        pivots = points[first[split]]
+        keep[pivots] = True
+        starts, ends = np.concatenate([starts[split], pivots]), np.concatenate([pivots, ends[split]])
+    return np.flatnonzero(keep)
+
+def visvalingam_indices(ys: np.ndarray, xs: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    使用Visvalingam-Whyatt算法简化轨迹：反复移除与相邻两点构成三角形面积最小的点，
+    直到所有剩余点的面积都不小于 tolerance²
+    Args:
+        ys: 纵坐标数组
+        xs: 横坐标数组
+        tolerance: 简化容忍度（与坐标同单位）
     Returns:
-        List[TrailPoint]: 简化后的轨迹点列表
-    """
-    if len(points) <= 2:
-        return points.copy()
-    max_dist = 0.0
-    index = 0
-    end = len(points) - 1
-    for i in range(1, end):
-        dist = perpendicular_distance(points[i], points[0], points[end])
-        if dist > max_dist:
-            index = i
-            max_dist = dist
-    if max_dist > tolerance:
-        left = douglas_peucker(points[:index+1], tolerance)
-        right = douglas_peucker(points[index:], tolerance)
-        return left[:-1] + right
-    else:
-        return [points[0], points[-1]]
-
-def clean_trail(trail: TrailLine, simplify: bool = False, tolerance: float = 0.0001) -> TrailLine:
+        np.ndarray: 保留点的下标（升序）
+    """
+    n = len(ys)
+    if n <= 2:
+        return np.arange(n)
+    threshold = tolerance ** 2
+
+    def area(i, j, k):
+        return abs((xs[j] - xs[i]) * (ys[k] - ys[i]) - (xs[k] - xs[i]) * (ys[j] - ys[i])) / 2
+
+    prev = np.arange(-1, n - 1)
+    nxt = np.arange(1, n + 1)
+    areas = np.full(n, np.inf)
+    areas[1:-1] = np.abs((xs[1:-1] - xs[:-2]) * (ys[2:] - ys[:-2]) -
+                         (xs[2:] - xs[:-2]) * (ys[1:-1] - ys[:-2])) / 2
+    heap = [(a, i) for i, a in enumerate(areas[1:-1].tolist(), 1)]
+    heapq.heapify(heap)
+    removed = np.zeros(n, dtype=bool)
+    while heap:
+        a, i = heapq.heappop(heap)
+        if removed[i] or a != areas[i]:
+            continue
+        if a >= threshold:
+            break
+        removed[i] = True
+        p, q = prev[i], nxt[i]
+        nxt[p], prev[q] = q, p
+        # 更新相邻点的面积（不小于被移除点的面积，保证移除顺序单调）
+        for j in (p, q):
+            if 0 < j < n - 1:
+                areas[j] = max(area(prev[j], j, nxt[j]), a)
+                heapq.heappush(heap, (areas[j], j))
+    return np.flatnonzero(~removed)
+
+def simplify_points(trail: TrailLine, tolerance: float, metric: bool = False,
+                    method: str = "dp") -> TrailLine:
+    """
+    简化轨迹
+    Args:
+        trail: 原始轨迹线
+        tolerance: 简化容忍度，metric 为 False 时单位为度，否则为米
+        metric: 是否按米计算距离
+        method: "dp"（Douglas-Peucker）或 "visvalingam"
+    Returns:
+        TrailLine: 简化后的轨迹线
+    """
+    if len(trail) <= 2:
+        return trail
+    ys, xs = trail.lats, trail.lngs
+    if metric:
+        ys, xs = to_local_meters(ys, xs)
+    simplify = visvalingam_indices if method == "visvalingam" else douglas_peucker_indices
+    return trail[simplify(ys, xs, tolerance)]
+
+def douglas_peucker(trail: TrailLine, tolerance: float) -> TrailLine:
+    """
+    使用Douglas-Peucker算法简化轨迹
+    Args:
+        trail: 原始轨迹线
+        tolerance: 简化容忍度（度）
+    Returns:
+        TrailLine: 简化后的轨迹线
+    """
+    return simplify_points(trail, tolerance)
+
+def clean_trail(trail: TrailLine, simplify: bool = False, tolerance: float = 0.0001,
+                metric: bool = False, method: str = "dp") -> TrailLine:
     """
     清理轨迹数据
     Args:
         trail: 原始轨迹线
         simplify: 是否进行轨迹简化
-        tolerance: 简化容忍度
+        tolerance: 简化容忍度（度，metric 为 True 时为米）
+        metric: 是否按米计算简化距离
+        method: 简化算法，"dp" 或 "visvalingam"
     Returns:
         TrailLine: 清理后的轨迹线
     """
-    points = remove_duplicate_points(trail)
+    trail = remove_duplicate_points(trail)
     if simplify:
-        points = douglas_peucker(points, tolerance)
-    return TrailLine(taxi_id=trail.taxi_id, points=points)
+        trail = simplify_points(trail, tolerance, metric, method)
+    return trail
+
+def iter_trail_lines(taxi_ids, simplify=False, tolerance=0.0001, metric=False, method="dp", zoom=None, viewport=None):
+    """
+    按请求顺序逐辆产生轨迹线（多线程分批加载）
+    Args:
+        taxi_ids: 出租车ID列表
+        simplify: 是否进行轨迹简化
+        tolerance: 简化容忍度
+        metric: tolerance 是否以米为单位
+        method: 简化算法
+        zoom: 地图缩放级别，指定时从LOD金字塔取对应层（忽略 simplify 等参数）
+        viewport: 视口 {"ltPoint", "rbPoint"}，指定时裁剪到视口范围
+    Yields:
+        TrailLine: 轨迹线，没有有效数据的车辆不输出
+    """
+    level = lod_level(zoom) if zoom is not None else None
+
+    def process_taxi_id(taxi_id):
+        if level is not None:
+            trail = load_lod_trail(taxi_id, level)
+        else:
+            trail = load_taxi_data(taxi_id)
+            if trail:
+                trail = clean_trail(trail, simplify and zoom is None, tolerance, metric, method)
+        if trail and viewport:
+            trail = clip_trail(trail, viewport)
+        return trail
+
+    with ThreadPoolExecutor(max_workers=LOAD_THREADS) as executor:
+        for i in range(0, len(taxi_ids), LOAD_WINDOW):
+            for trail in executor.map(process_taxi_id, taxi_ids[i:i + LOAD_WINDOW]):
+                if trail:
+                    yield trail
+
+def iter_trails(*args, **kwargs):
+    """
+    按请求顺序逐辆产生轨迹数据（参数见 iter_trail_lines）
+    Yields:
+        dict: {"vendor": 出租车ID, "path": [[纬度, 经度, 时间戳], ...]}，没有有效数据的车辆不输出
+    """
+    for trail in iter_trail_lines(*args, **kwargs):
+        yield {"vendor": int(trail.taxi_id), "path": trail.to_path()}
 
 # F1
 @app.route('/trailLists', methods=['GET'])
 def get_trail_lists():
     """
-    处理GET请求，根据传入的关键字返回带有该关键字的前50条出租车轨迹ID列表
+    处理GET请求，根据传入的关键字返回包含该关键字的出租车轨迹ID（以关键字开头的在前，其余按ID升序）
+    Query 参数:
+        keyword: 关键字
+        page: 可选，页码（从1开始），指定时返回 {"total", "page", "pageSize", "ids"}
+        pageSize: 可选，每页条数，默认50
     Returns:
-        JSON响应：包含符合条件的出租车轨迹ID列表
+        JSON响应：未指定 page 时为前 pageSize 条ID的列表
     """
     keyword = request.args.get('keyword', '')
+    page = request.args.get('page')
     try:
-        all_taxi_ids = [f.split('.')[0] for f in os.listdir(DATA_DIR) if f.endswith('.txt')]
-        matching_ids = []
-        for taxi_id in all_taxi_ids:
-            if keyword in taxi_id:
-                matching_ids.append(taxi_id)
-                if len(matching_ids) >= 50:
-                    break
+        page_size = max(int(request.args.get('pageSize', SEARCH_PAGE_SIZE)), 1)
+        page_number = max(int(page), 1) if page is not None else 1
+    except ValueError:
+        return jsonify({"error": "Invalid page parameters"}), 400
+    try:
+        catalog = load_catalog(open_store(DATA_DIR))
     except FileNotFoundError:
         return jsonify({"error": "Data directory not found"}), 500
 
-    return jsonify(matching_ids)
+    total, ids = catalog.search(keyword, (page_number - 1) * page_size, page_size)
+    if page is None:
+        return jsonify(ids)
+    return jsonify({"total": total, "page": page_number, "pageSize": page_size, "ids": ids})
 
 @app.route('/trails/data', methods=['POST'])
 def get_trails_post():
@@ -193,9 +551,15 @@ def get_trails_post():
     {
         "taxi_ids": ["1", "2"],         # 可选，若不传则查询所有
         "simplify": true,               # 可选，默认 false
-        "tolerance": 0.0001             # 可选，轨迹简化容忍度
-        "sample_count": 10               # 可选，随机抽样数量
+        "tolerance": 0.0001             # 可选，轨迹简化容忍度（度）
+        "toleranceMeters": 10,          # 可选，以米为单位的简化容忍度，优先于 tolerance
+        "simplifyMethod": "dp",         # 可选，dp（Douglas-Peucker，默认）或 visvalingam（移除面积小于容忍度平方的点）
+        "zoom": 12,                     # 可选，地图缩放级别，按级别返回预计算的LOD层
+        "viewport": {"ltPoint": [经度, 纬度], "rbPoint": [经度, 纬度]},  # 可选，只返回视口内的轨迹
+        "sample_count": 10,              # 可选，随机抽样数量
+        "stream": true                   # 可选，为true（或 Accept: application/x-ndjson）时以NDJSON逐车流式返回
     }
+    Accept: application/x-trails 时返回二进制轨迹（见 trail_codec）
     """
     try:
         req = request.get_json(force=True)
@@ -207,10 +571,17 @@ def get_trails_post():
     sample_count = req.get("sampleCount", None)
     simplify = req.get("simplify", False)
     tolerance = float(req.get("tolerance", 0.0001))
+    metric = "toleranceMeters" in req
+    if metric:
+        tolerance = float(req["toleranceMeters"])
+    method = req.get("simplifyMethod", "dp")
+    zoom = req.get("zoom")
+    zoom = float(zoom) if zoom is not None else None
+    viewport = req.get("viewport")
                       
     if taxi_ids == "all":
         try:
-            all_ids = [f.split('.')[0] for f in os.listdir(DATA_DIR) if f.endswith('.txt')]
+            all_ids = list(load_catalog(open_store(DATA_DIR)).ids)
             if sample_count:
                 sample_count = int(sample_count)
                 random.shuffle(all_ids)
@@ -220,26 +591,14 @@ def get_trails_post():
         except FileNotFoundError:
             return jsonify({"error": "Data directory not found"}), 500
 
-    result = []
-    def process_taxi_id(taxi_id):
-        trail = load_taxi_data(taxi_id)
-        if trail:
-            trail = clean_trail(trail, simplify, tolerance)
-            transformed_points = []
-            for pt in trail.points:
-                lng_gcj, lat_gcj = wgs84_to_gcj02(pt.longitude, pt.latitude)
-                transformed_points.append([lat_gcj, lng_gcj, datetime.strptime(pt.timestamp, "%Y-%m-%d %H:%M:%S").timestamp()])
-            return {
-                "vendor": int(trail.taxi_id),
-                "path": transformed_points
-            }
-        return None
-
-    with ThreadPoolExecutor(max_workers=16) as executor:
-        results = list(executor.map(process_taxi_id, taxi_ids))
-
-    result = [r for r in results if r]
-    return jsonify(result)
+    if wants_binary():
+        # 直接编码轨迹的列数组，不经过 Python 列表
+        return binary_response((int(trail.taxi_id), trail.lats, trail.lngs, trail.timestamps)
+                               for trail in iter_trail_lines(taxi_ids, simplify, tolerance, metric, method, zoom,
+                                                             viewport))
+    if wants_ndjson(req):
+        return ndjson_response(iter_trails(taxi_ids, simplify, tolerance, metric, method, zoom, viewport))
+    return jsonify(list(iter_trails(taxi_ids, simplify, tolerance, metric, method, zoom, viewport)))
 
 
 if __name__ == "__main__":
@@ -14,8 +14,12 @@
 
 from flask import Flask, request, jsonify
 import sqlite3
-import datetime
-from coordTransform import wgs84_to_gcj02,gcj02_to_wgs84
+import numpy as np
+from trajectory_store import parse_time, format_time, to_timestamp, open_store
+from build_trajectory_db import REGION_QUERY, REGION_QUERY_FOR_TAXI, load_time_base
+from streaming import wants_ndjson, ndjson_response
+from trail_codec import wants_binary, binary_response
+from region_index import load_region_index, count_region, region_candidates
 
 # 初始化Flask应用
 app = Flask(__name__)
@@ -23,11 +27,46 @@ app = Flask(__name__)
 # 数据库路径
 DB_PATH = "trajectory.db"
 
-def transform_wgs84_to_gcj02_point(lng, lat):
-    return wgs84_to_gcj02(lng, lat)
-
-def transform_gcj02_to_wgs84_point(lng, lat):
-    return gcj02_to_wgs84(lng, lat)
+def iter_region_columns(region):
+    """
+    按车辆逐条产生区域查询结果的列数组（用于流式响应）：
+    由区域计数索引的轨迹片段得到可能命中的车辆及其时间范围，逐车查询数据库（结果与 REGION_QUERY 相同），
+    不对全部结果排序，查完第一辆命中的车即可输出
+    Args:
+        region: 区域查询参数（经纬度、时间上下界，时间为存储使用的秒数）
+    Yields:
+        (taxi_id, lats, lngs, timestamps): 出租车ID与 GCJ02 纬度、经度、Unix时间戳数组，按车辆ID（字符串）排序
+    """
+    store = open_store()
+    taxi_ids, first_epochs, last_epochs = region_candidates(load_region_index(store), region)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        time_base = load_time_base(conn)
+        min_lng, max_lng, min_lat, max_lat, start_epoch, end_epoch = region
+        bounds = (min_lng, max_lng, min_lat, max_lat, start_epoch - time_base, end_epoch - time_base)
+        for taxi_id, first_epoch, last_epoch in sorted(zip(taxi_ids.astype(str).tolist(), first_epochs.tolist(),
+                                                           last_epochs.tolist())):
+            rows = conn.execute(REGION_QUERY_FOR_TAXI, (taxi_id, format_time(first_epoch), format_time(last_epoch))
+                                + bounds).fetchall()
+            if not rows:
+                continue
+            times, lngs_gcj, lats_gcj = zip(*rows)
+            timestamps = to_timestamp(np.array(times, dtype='datetime64[s]').astype(np.int64))
+            yield int(taxi_id), np.array(lats_gcj), np.array(lngs_gcj), timestamps
+    finally:
+        conn.close()
+
+def iter_region_trails(region):
+    """
+    按车辆逐条产生区域查询结果（用于流式响应，见 iter_region_columns）
+    Yields:
+        dict: {"vender": 出租车ID, "path": [[纬度, 经度, 时间戳], ...]}，最后一条为 {"total": 轨迹数量}
+    """
+    total = 0
+    for taxi_id, lats, lngs, timestamps in iter_region_columns(region):
+        total += 1
+        yield {"vender": taxi_id, "path": [list(point) for point in zip(lats.tolist(), lngs.tolist(), timestamps.tolist())]}
+    yield {"total": total}
 
 @app.route('/query_region', methods=['POST'])
 def query_region():
@@ -39,7 +78,9 @@ def query_region():
             "startTime": "YYYY-MM-DD HH:MM:SS",  # 开始时间
             "endTime": "YYYY-MM-DD HH:MM:SS",    # 结束时间
             "ltPoint": [经度, 纬度],              # 区域左上角坐标
-            "rbPoint": [经度, 纬度]               # 区域右下角坐标
+            "rbPoint": [经度, 纬度],              # 区域右下角坐标
+            "stream": false,                      # 可选，为true（或 Accept: application/x-ndjson）时以NDJSON逐车流式返回
+            "countOnly": false                    # 可选，为true时只返回车辆数与点数，不取出轨迹
         }
 
     返回：
@@ -53,48 +94,51 @@ def query_region():
                     }
                 ]
             }
+        Accept: application/x-trails 时返回二进制轨迹（见 trail_codec），车辆顺序与流式模式相同
+        流式模式下每行一个 {"vender": 出租车ID, "path": [轨迹点]}，按车辆排序，最后一行为 {"total": 轨迹数量}
+        countOnly 时返回 {"total": 轨迹数量, "points": 轨迹点数}，由列式存储的区域计数索引（见 region_index）得到
     """
     req = request.get_json()
     try:
-        start_time = datetime.datetime.strptime(req.get('startTime'), "%Y-%m-%d %H:%M:%S")
-        end_time = datetime.datetime.strptime(req.get('endTime'), "%Y-%m-%d %H:%M:%S")
+        start_epoch = parse_time(req.get('startTime'))
+        end_epoch = parse_time(req.get('endTime'))
         lt_gcj = req.get('ltPoint', [116.0, 40.0])
         rb_gcj = req.get('rbPoint', [117.0, 39.0])
     except Exception as e:
         return jsonify({"error": "Invalid input format", "details": str(e)}), 400
 
-    lt_point = transform_gcj02_to_wgs84_point(lt_gcj[0], lt_gcj[1])
-    rb_point = transform_gcj02_to_wgs84_point(rb_gcj[0], rb_gcj[1])
-    
+    region = (lt_gcj[0], rb_gcj[0], rb_gcj[1], lt_gcj[1], start_epoch, end_epoch)
+    if req.get('countOnly'):
+        store = open_store()
+        points, total = count_region(store, load_region_index(store), region)
+        return jsonify({"total": total, "points": points})
+    if wants_binary():
+        return binary_response(iter_region_columns(region))
+    if wants_ndjson(req):
+        return ndjson_response(iter_region_trails(region))
+
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT d.taxi_id, d.time, d.lng, d.lat
-        FROM traj_index AS i
-        JOIN traj_data AS d ON d.point_id = i.point_id
-        WHERE
-            i.min_lng >= ? AND i.max_lng <= ?
-            AND i.min_lat >= ? AND i.max_lat <= ?
-            AND d.time BETWEEN ? AND ?
-    """, (
-        lt_point[0], rb_point[0],
-        rb_point[1], lt_point[1],
-        start_time.strftime("%Y-%m-%d %H:%M:%S"),
-        end_time.strftime("%Y-%m-%d %H:%M:%S")
+    # 索引与数据均为GCJ02坐标；时间作为R-tree的第三个维度（相对时间基准的秒数），与经纬度一同走索引
+    time_base = load_time_base(conn)
+    cursor.execute(REGION_QUERY, (
+        lt_gcj[0], rb_gcj[0],
+        rb_gcj[1], lt_gcj[1],
+        start_epoch - time_base,
+        end_epoch - time_base
     ))
 
+    rows = cursor.fetchall()
     result = {}
-    for taxi_id, time, lng, lat in cursor.fetchall():
-        lng_gcj, lat_gcj = transform_wgs84_to_gcj02_point(lng, lat)
-        if taxi_id not in result:
-            result[taxi_id] = []
-        result[taxi_id].append([
-            lat_gcj,
-             lng_gcj,
-             datetime.datetime.strptime(time, "%Y-%m-%d %H:%M:%S").timestamp()])
-        # if len(result)==50:
-        #     break
+    if rows:
+        # 批量转换时间
+        taxi_ids, times, lngs_gcj, lats_gcj = zip(*rows)
+        timestamps = to_timestamp(np.array(times, dtype='datetime64[s]').astype(np.int64))
+        for taxi_id, lat_gcj, lng_gcj, timestamp in zip(taxi_ids, lats_gcj, lngs_gcj, timestamps.tolist()):
+            if taxi_id not in result:
+                result[taxi_id] = []
+            result[taxi_id].append([lat_gcj, lng_gcj, timestamp])
 
     conn.close()
 
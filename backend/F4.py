@@ -1,80 +1,230 @@
 from flask import Flask, request, jsonify
 import os
+import json
 import math
+import threading
 import numpy as np
-from multiprocessing import Pool, cpu_count, shared_memory
-from coordTransform_utils import wgs84_to_gcj02
+from service import map_partitions
+from trajectory_store import (BEIJING_BOUNDS, TIME_BUCKET_SECONDS, attach_store, open_store, resolve_data_dir, hour_of_day, time_bucket,
+                              bucket_hours, parse_time_window)
 import time
 
 app = Flask(__name__)
 
-# 北京边界坐标（GCJ02）
-BEIJING_BOUNDS = {
-    'min_lng': 115.70,
-    'max_lng': 117.50, 
-    'min_lat': 39.40,
-    'max_lat': 41.60
-}
-
-def is_in_beijing(lng, lat):
-    """检查坐标是否在北京范围内"""
-    return (BEIJING_BOUNDS['min_lng'] <= lng <= BEIJING_BOUNDS['max_lng'] and
-            BEIJING_BOUNDS['min_lat'] <= lat <= BEIJING_BOUNDS['max_lat'])
-
-def create_shared_heatmap(grid_size=0.01):
-    """创建共享内存的热力图网格（修正维度问题）"""
-    # 计算网格数量
+# 热力图立方体的最细分辨率（度），grid_width 为其整数倍时由立方体按块求和得到
+CUBE_GRID_SIZE = 0.002
+# 立方体按 (时间桶, 网格) 稀疏保存：按时间桶排序，每个时间桶的非零网格是 cells/counts 中连续的一段
+CUBE_FILE = "heatmap_cube.npz"
+CUBE_META_FILE = "heatmap_cube.json"
+CUBE_FIELDS = ("buckets", "offsets", "cells", "counts")
+
+# 各存储的稀疏立方体，以及不限时间窗口时的分辨率金字塔：{存储目录: {倍数: (24, lng_size, lat_size) 数组}}
+_heatmap_cubes = {}
+_heatmap_levels = {}
+_heatmap_lock = threading.Lock()
+
+def heatmap_dims(grid_size):
+    """计算网格数量"""
     lng_size = int((BEIJING_BOUNDS['max_lng'] - BEIJING_BOUNDS['min_lng']) / grid_size) + 1
     lat_size = int((BEIJING_BOUNDS['max_lat'] - BEIJING_BOUNDS['min_lat']) / grid_size) + 1
-    
-    # 创建共享内存
-    shm = shared_memory.SharedMemory(
-        create=True,
-        size=24*lng_size*lat_size*4  # 24小时×经度×纬度×4字节
-    )
-    # 正确的三维数组reshape
-    heatmap = np.ndarray((24, lng_size, lat_size), dtype=np.int32, buffer=shm.buf)
-    heatmap.fill(0)
-    return shm, (lng_size, lat_size)  # 返回网格尺寸信息
+    return lng_size, lat_size
+
+def grid_cells(lngs, lats, grid_size, grid_dims):
+    """
+    返回北京范围内、且落在 grid_dims 网格内的点，以及这些点的网格编号（经度序号 × lat_size + 纬度序号）
+    """
+    lng_size, lat_size = grid_dims
+    # 过滤非北京坐标
+    in_beijing = ((BEIJING_BOUNDS['min_lng'] <= lngs) & (lngs <= BEIJING_BOUNDS['max_lng']) &
+                  (BEIJING_BOUNDS['min_lat'] <= lats) & (lats <= BEIJING_BOUNDS['max_lat']))
+    grid_xs = ((lngs - BEIJING_BOUNDS['min_lng']) / grid_size).astype(np.int64)
+    grid_ys = ((lats - BEIJING_BOUNDS['min_lat']) / grid_size).astype(np.int64)
+    # 边界检查
+    kept = np.flatnonzero(in_beijing & (grid_xs < lng_size) & (grid_ys < lat_size))
+    return kept, grid_xs[kept] * lat_size + grid_ys[kept]
 
 def process_file_optimized(args):
-    """修正后的文件处理函数"""
-    filename, folder_path, grid_size, shm_name, grid_dims = args
-    try:
-        existing_shm = shared_memory.SharedMemory(name=shm_name)
-        lng_size, lat_size = grid_dims
-        # 正确reshape共享内存
-        heatmap = np.ndarray((24, lng_size, lat_size), dtype=np.int32, buffer=existing_shm.buf)
-        
-        with open(os.path.join(folder_path, filename), 'r', encoding='utf-8') as file:
-            for line in file:
-                parts = line.split(',', 3)
-                if len(parts) < 4:
-                    continue
-                
-                try:
-                    _, time_str, lng_str, lat_str = parts
-                    lng, lat = wgs84_to_gcj02(float(lng_str), float(lat_str))
-                    
-                    # 过滤非北京坐标
-                    if not is_in_beijing(lng, lat):
-                        continue
-                    
-                    hour = int(time_str[11:13])  # 直接提取小时部分
-                    grid_x = int((lng - BEIJING_BOUNDS['min_lng']) / grid_size)
-                    grid_y = int((lat - BEIJING_BOUNDS['min_lat']) / grid_size)
-                    
-                    # 边界检查
-                    if 0 <= grid_x < lng_size and 0 <= grid_y < lat_size:
-                        heatmap[hour, grid_x, grid_y] += 1
-                except (ValueError, IndexError):
-                    continue
-    finally:
-        existing_shm.close()
+    """
+    统计列式存储中 [start, end) 区间的轨迹点（在子进程中执行）
+    Returns:
+        (cells, counts): 本区间有点的网格在展平热力图中的下标（升序）及点数，由主进程汇总；
+                         最细分辨率下整张热力图很大，只返回非零网格
+    """
+    store_dir, start, end, grid_size, grid_dims, window = args
+    lng_size, lat_size = grid_dims
+    epoch, lngs, lats = attach_store(store_dir).gcj_columns(start, end)
+    kept, cells = grid_cells(lngs, lats, grid_size, grid_dims)
+    epoch = epoch[kept]
+    if window is not None:
+        in_window = window.point_mask(epoch)
+        epoch, cells = epoch[in_window], cells[in_window]
+    return np.unique(hour_of_day(epoch) * (lng_size * lat_size) + cells, return_counts=True)
+
+def scan_heatmap(store, grid_size, window=None):
+    """
+    在常驻进程池中并行扫描列式存储，统计 (24, lng_size, lat_size) 热力图。
+    各进程只统计自己的区间，主进程一次性汇总，不在进程间共享可写数组
+    Args:
+        store: 列式轨迹存储
+        grid_size: 网格宽度
+        window: 可选，TimeWindow 时间窗口
+    Returns:
+        np.ndarray: 各小时各网格的点数
+    """
+    grid_dims = heatmap_dims(grid_size)
+    lng_size, lat_size = grid_dims
+    parts = map_partitions(process_file_optimized, store, grid_size, grid_dims, window)
+    heatmap = np.zeros(24 * lng_size * lat_size, dtype=np.int32)
+    if parts:
+        np.add.at(heatmap, np.concatenate([cells for cells, _ in parts]),
+                  np.concatenate([counts for _, counts in parts]).astype(np.int32))
+    return heatmap.reshape(24, lng_size, lat_size)
+
+def cube_partition(args):
+    """
+    按 (时间桶, 最细网格) 统计 [start, end) 区间的轨迹点（在子进程中执行）
+    Returns:
+        (keys, counts): 时间桶 × 网格数 + 网格编号（升序）及点数
+    """
+    store_dir, start, end = args
+    grid_dims = heatmap_dims(CUBE_GRID_SIZE)
+    epoch, lngs, lats = attach_store(store_dir).gcj_columns(start, end)
+    kept, cells = grid_cells(lngs, lats, CUBE_GRID_SIZE, grid_dims)
+    return np.unique(time_bucket(epoch[kept]) * (grid_dims[0] * grid_dims[1]) + cells, return_counts=True)
+
+def build_heatmap_cube(store):
+    """
+    在常驻进程池中统计稀疏立方体，各区间的结果在主进程中合并一次
+    Returns:
+        dict: buckets（有点的时间桶，升序）、offsets（每个时间桶在 cells/counts 中的起始位置，长度+1）、
+              cells（最细网格编号）、counts（点数）
+    """
+    lng_size, lat_size = heatmap_dims(CUBE_GRID_SIZE)
+    # 空存储没有区间，在本进程中统计一个空区间，得到结构相同的空立方体
+    parts = map_partitions(cube_partition, store) or [cube_partition((store.path, 0, 0))]
+    keys, inverse = np.unique(np.concatenate([part[0] for part in parts]), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([part[1] for part in parts])).astype(np.int32)
+    buckets, cells = np.divmod(keys, lng_size * lat_size)
+    distinct, starts = np.unique(buckets, return_index=True)
+    return {"buckets": distinct, "offsets": np.append(starts, len(keys)).astype(np.int64),
+            "cells": cells.astype(np.int32), "counts": counts}
+
+def load_heatmap_cube(store):
+    """
+    读取最细分辨率的稀疏热力图立方体，不存在或与存储不一致时重新统计并落盘。
+    立方体保存在列式存储目录内，源数据变化导致存储重建时随之失效。
+    """
+    cube_file = os.path.join(store.path, CUBE_FILE)
+    meta_file = os.path.join(store.path, CUBE_META_FILE)
+    expected = {"grid_size": CUBE_GRID_SIZE, "bounds": BEIJING_BOUNDS, "bucket_seconds": TIME_BUCKET_SECONDS,
+                "source": store.meta["source"]}
+    cube = None
+    if os.path.exists(cube_file) and os.path.exists(meta_file):
+        with open(meta_file) as f:
+            if json.load(f) == expected:
+                with np.load(cube_file) as data:
+                    cube = {name: data[name] for name in CUBE_FIELDS}
+    if cube is None:
+        cube = build_heatmap_cube(store)
+        np.savez(cube_file, **cube)
+        with open(meta_file, 'w') as f:
+            json.dump(expected, f)
+    # 每个非零网格所在的小时
+    cube["hours"] = np.repeat(bucket_hours(cube["buckets"]), np.diff(cube["offsets"])).astype(np.int8)
+    return cube
+
+def aggregate_cube(cube, factor, grid_dims, window=None):
+    """
+    将稀疏立方体中时间窗口内的点按小时、factor×factor 块求和
+    Args:
+        cube: load_heatmap_cube 返回的稀疏立方体
+        factor: 目标网格宽度为最细分辨率的倍数
+        grid_dims: 目标网格尺寸（与直接按目标宽度划分的网格对齐，超出部分丢弃）
+        window: 可选，TimeWindow 时间窗口；只读取窗口内时间桶对应的片段
+    Returns:
+        np.ndarray: (24, lng_size, lat_size) 各小时各网格的点数
+    """
+    lng_size, lat_size = grid_dims
+    cells, counts, hours = cube["cells"], cube["counts"], cube["hours"]
+    if window is not None:
+        entries = np.repeat(window.bucket_mask(cube["buckets"]), np.diff(cube["offsets"]))
+        cells, counts, hours = cells[entries], counts[entries], hours[entries]
+    grid_xs, grid_ys = np.divmod(cells, heatmap_dims(CUBE_GRID_SIZE)[1])
+    grid_xs, grid_ys = grid_xs // factor, grid_ys // factor
+    inside = (grid_xs < lng_size) & (grid_ys < lat_size)
+    heatmap = np.zeros(24 * lng_size * lat_size, dtype=np.int32)
+    np.add.at(heatmap, (hours[inside].astype(np.int64) * lng_size + grid_xs[inside]) * lat_size + grid_ys[inside],
+              counts[inside])
+    return heatmap.reshape(24, lng_size, lat_size)
+
+def get_heatmap_level(store, grid_size, window=None):
+    """
+    从稀疏立方体获取指定网格宽度、时间窗口的热力图（不限时间窗口的结果按网格宽度缓存）
+    Returns:
+        np.ndarray 或 None: grid_width 不是立方体分辨率的整数倍时返回None
+    """
+    factor = round(grid_size / CUBE_GRID_SIZE)
+    if factor < 1 or not math.isclose(factor * CUBE_GRID_SIZE, grid_size, rel_tol=1e-9):
+        return None
+
+    with _heatmap_lock:
+        if store.path not in _heatmap_cubes:
+            _heatmap_cubes[store.path] = load_heatmap_cube(store)
+        cube = _heatmap_cubes[store.path]
+        if window is None:
+            levels = _heatmap_levels.setdefault(store.path, {})
+            if factor not in levels:
+                levels[factor] = aggregate_cube(cube, factor, heatmap_dims(grid_size))
+            return levels[factor]
+    return aggregate_cube(cube, factor, heatmap_dims(grid_size), window)
+
+def heatmap_cells(heatmap, grid_size, min_count=1, top_n=None):
+    """
+    提取非空网格及其中心坐标
+    Args:
+        heatmap: (24, lng_size, lat_size) 或单小时的 (lng_size, lat_size) 计数数组
+        grid_size: 网格宽度
+        min_count: 只保留点数不小于该值的网格
+        top_n: 可选，只保留点数最多的 top_n 个网格（并列时按网格顺序）
+    Returns:
+        (columns, total): 列名 -> 列表（lng、lat、count，三维输入时还有 hour），按 小时、经度、纬度 排序；
+                          total 为满足 min_count 的网格总数
+    """
+    cells = np.nonzero(heatmap >= max(min_count, 1))
+    counts = heatmap[cells]
+    total = len(counts)
+    if top_n is not None and top_n < total:
+        selected = np.sort(np.argsort(-counts, kind='stable')[:max(top_n, 0)])
+        cells = tuple(index[selected] for index in cells)
+        counts = counts[selected]
+    *hours, grid_xs, grid_ys = cells
+    columns = {
+        "lng": np.round(BEIJING_BOUNDS['min_lng'] + grid_xs * grid_size + grid_size / 2, 6).tolist(),
+        "lat": np.round(BEIJING_BOUNDS['min_lat'] + grid_ys * grid_size + grid_size / 2, 6).tolist(),
+        "count": counts.tolist()
+    }
+    if hours:
+        columns["hour"] = hours[0].tolist()
+    return columns, total
 
 @app.route('/api/heatmap', methods=['GET'])
 def get_optimized_heatmap():
-    """修正后的热力图端点"""
+    """
+    热力图端点
+
+    请求参数：
+        grid_width: 可选，网格宽度（度），默认0.01
+        hour: 可选，只返回该小时
+        folder_path: 可选，数据目录
+        startTime, endTime: 可选，时间窗口 "YYYY-MM-DD HH:MM:SS"，按15分钟时间桶对齐
+        weekdays: 可选，只统计星期几，如 "5,6"（0为星期一）
+        format: 可选，rows（默认，[{lng, lat, count, hour}]）或 columns（{lng: [], lat: [], count: [], hour: []}）
+        minCount: 可选，只返回点数不小于该值的网格，默认1
+        topN: 可选，只返回点数最多的 topN 个网格
+
+    返回：
+        data 为非空网格（按 小时、经度、纬度 排序），total_cells 为满足 minCount 的网格总数
+    """
     start_time = time.time()
     
     try:
@@ -82,62 +232,36 @@ def get_optimized_heatmap():
         grid_size = float(request.args.get('grid_width', 0.01))
         target_hour = int(request.args['hour']) if 'hour' in request.args else None
         folder_path = request.args.get('folder_path', 'taxi_log_2008_by_id')
+        output_format = request.args.get('format', 'rows')
+        min_count = int(request.args.get('minCount', 1))
+        top_n = int(request.args['topN']) if 'topN' in request.args else None
+        window = parse_time_window(request.args)
+        if output_format not in ('rows', 'columns'):
+            raise ValueError(f"不支持的格式: {output_format}")
         
-        # 创建共享热力图（获取网格尺寸）
-        shm, grid_dims = create_shared_heatmap(grid_size)
-        lng_size, lat_size = grid_dims
-        
-        try:
-            # 并行处理
-            files = [f for f in os.listdir(folder_path) if f.endswith('.txt')]
-            with Pool(min(cpu_count(), 4)) as pool:
-                pool.map(process_file_optimized,
-                        [(f, folder_path, grid_size, shm.name, grid_dims) for f in files],
-                        chunksize=5)
-            
-            # 生成响应数据
-            heatmap = np.ndarray((24, lng_size, lat_size), dtype=np.int32, buffer=shm.buf)
-            result = []
-            lng_step = grid_size
-            lat_step = grid_size
-            
-            if target_hour is not None:
-                # 单小时模式
-                hour_data = heatmap[target_hour]
-                for x in range(lng_size):
-                    for y in range(lat_size):
-                        count = int(hour_data[x, y])
-                        if count > 0:
-                            result.append({
-                                "lng": round(BEIJING_BOUNDS['min_lng'] + x * lng_step + lng_step/2, 6),
-                                "lat": round(BEIJING_BOUNDS['min_lat'] + y * lat_step + lat_step/2, 6),
-                                "count": count
-                            })
-            else:
-                # 全时段模式
-                for hour in range(24):
-                    hour_data = heatmap[hour]
-                    for x in range(lng_size):
-                        for y in range(lat_size):
-                            count = int(hour_data[x, y])
-                            if count > 0:
-                                result.append({
-                                    "lng": round(BEIJING_BOUNDS['min_lng'] + x * lng_step + lng_step/2, 6),
-                                    "lat": round(BEIJING_BOUNDS['min_lat'] + y * lat_step + lat_step/2, 6),
-                                    "count": count,
-                                    "hour": hour
-                                })
-            
-            return jsonify({
-                "status": "success",
-                "data": result,
-                "process_time": round(time.time() - start_time, 2),
-                "grid_size": grid_size
-            })
+        # 优先由预计算的稀疏立方体回答，其余网格宽度实时扫描
+        store = open_store(resolve_data_dir(folder_path))
+        heatmap = get_heatmap_level(store, grid_size, window)
+        if heatmap is None:
+            heatmap = scan_heatmap(store, grid_size, window)
+        if target_hour is not None:
+            heatmap = heatmap[target_hour]
+
+        # 生成响应数据
+        columns, total = heatmap_cells(heatmap, grid_size, min_count, top_n)
+        if output_format == 'columns':
+            result = columns
+        else:
+            names = list(columns)
+            result = [dict(zip(names, row)) for row in zip(*columns.values())]
         
-        finally:
-            shm.close()
-            shm.unlink()
+        return jsonify({
+            "status": "success",
+            "data": result,
+            "total_cells": total,
+            "process_time": round(time.time() - start_time, 2),
+            "grid_size": grid_size
+        })
     
     except Exception as e:
         return jsonify({
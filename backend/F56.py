@@ -1,14 +1,33 @@
 from flask import Flask, request, jsonify
 import os
+import json
 import math
+import threading
 import numpy as np
-from multiprocessing import Pool, cpu_count, shared_memory
-from coordTransform_utils import wgs84_to_gcj02
+from service import POOL_WORKERS, map_partitions
+from trajectory_store import (BEIJING_BOUNDS, COORD_SCALE, TIME_BUCKET_SECONDS, attach_store, open_store, resolve_data_dir,
+                              hour_of_day, time_bucket, bucket_hours, parse_time_window)
+from taxi_catalog import load_catalog
 from datetime import datetime
 import time
 
 app = Flask(__name__)
 
+# 转移表网格大小（度，约100米）
+TRANSITION_GRID_SIZE = 0.001
+TRANSITION_FILE = "flow_transitions.npz"
+TRANSITION_META_FILE = "flow_transitions.json"
+TRANSITION_FIELDS = ("from_cell", "to_cell", "bucket", "count", "to_order", "point_order", "point_cells")
+
+GRID_COLS = int(round((BEIJING_BOUNDS['max_lng'] - BEIJING_BOUNDS['min_lng']) / TRANSITION_GRID_SIZE))
+GRID_ROWS = int(round((BEIJING_BOUNDS['max_lat'] - BEIJING_BOUNDS['min_lat']) / TRANSITION_GRID_SIZE))
+# 范围外的点统一归入该网格
+OUTSIDE_CELL = GRID_COLS * GRID_ROWS
+
+# 每个进程缓存已加载的转移表
+_transition_tables = {}
+_transition_lock = threading.Lock()
+
 # 预分配内存的数据结构
 class SpatialIndex:
     __slots__ = ['min_lng', 'max_lng', 'min_lat', 'max_lat', 'grid_size', 'cols', 'rows']
@@ -19,89 +38,260 @@ class SpatialIndex:
         self.cols = math.ceil((self.max_lng - self.min_lng) / grid_size)
         self.rows = math.ceil((self.max_lat - self.min_lat) / grid_size)
 
-def create_shared_flow_array():
-    """创建共享内存数组用于统计流量"""
-    shm = shared_memory.SharedMemory(create=True, size=24*2*4)  # 24小时×2种流量×4字节
-    arr = np.ndarray((24, 2), dtype=np.int32, buffer=shm.buf)
-    arr.fill(0)
-    return shm, arr
-
 def process_file_optimized(args):
-    """优化后的文件处理函数"""
-    filename, area1, area2, shm_name = args
-    try:
-        # 访问共享内存
-        existing_shm = shared_memory.SharedMemory(name=shm_name)
-        flow_stats = np.ndarray((24, 2), dtype=np.int32, buffer=existing_shm.buf)
-        
-        # 提前计算区域边界
-        a1_min_lng, a1_max_lng, a1_min_lat, a1_max_lat = area1
-        a2_bounds = area2 if area2 else None
-        
-        with open(filename, 'r') as file:
-            current_taxi = None
-            prev_in_a1 = False
-            prev_in_a2 = False
-            prev_hour = None
-            
-            for line in file:
-                # 使用快速分割方法
-                parts = line.split(',', 3)
-                if len(parts) < 4:
-                    continue
-                
-                try:
-                    taxi_id = parts[0]
-                    time_part = parts[1][11:13]  # 直接提取小时部分
-                    hour = int(time_part)
-                    lng = float(parts[2])
-                    lat = float(parts[3])
-                    
-                    # 坐标转换
-                    lng, lat = wgs84_to_gcj02(lng, lat)
-                    
-                    # 状态检查
-                    if taxi_id != current_taxi:
-                        current_taxi = taxi_id
-                        prev_in_a1 = False
-                        prev_in_a2 = False
-                        prev_hour = None
-                    
-                    # 区域判断（使用短路计算加速）
-                    in_a1 = (a1_min_lng <= lng <= a1_max_lng) and (a1_min_lat <= lat <= a1_max_lat)
-                    in_a2 = False
-                    if a2_bounds:
-                        a2_min_lng, a2_max_lng, a2_min_lat, a2_max_lat = a2_bounds
-                        in_a2 = (a2_min_lng <= lng <= a2_max_lng) and (a2_min_lat <= lat <= a2_max_lat)
-                    
-                    # 状态转移检测
-                    if prev_hour == hour:
-                        if a2_bounds:
-                            # 双区域模式
-                            if prev_in_a1 and in_a2:
-                                flow_stats[hour][1] += 1  # flowOut
-                            elif prev_in_a2 and in_a1:
-                                flow_stats[hour][0] += 1  # flowIn
-                        else:
-                            # 单区域模式
-                            if not prev_in_a1 and in_a1:
-                                flow_stats[hour][0] += 1  # flowIn
-                            elif prev_in_a1 and not in_a1:
-                                flow_stats[hour][1] += 1  # flowOut
-                    
-                    prev_in_a1 = in_a1
-                    prev_in_a2 = in_a2
-                    prev_hour = hour
-                
-                except (ValueError, IndexError):
-                    continue
-    
-    finally:
-        existing_shm.close()
+    """
+    统计列式存储中 [start, end) 区间内相邻两点的流量（在子进程中执行）
+    Returns:
+        np.ndarray: 本区间 (24, 2) 的 [flowIn, flowOut]，由主进程汇总
+    """
+    store_dir, start, end, area1, area2, window = args
+    store = attach_store(store_dir)
+    epoch, lngs, lats = store.gcj_columns(start, end)
+    taxi_ids = store.taxi_id[start:end]
+    hours = hour_of_day(epoch)
+    # 同一辆车、同一小时内的相邻两点，按前一点的时间计入时间窗口
+    valid = (taxi_ids[1:] == taxi_ids[:-1]) & (hours[1:] == hours[:-1])
+    if window is not None:
+        valid &= window.point_mask(epoch[:-1])
+
+    flags = []
+    for min_lng, max_lng, min_lat, max_lat in (area1, area2) if area2 else (area1,):
+        inside = (min_lng <= lngs) & (lngs <= max_lng) & (min_lat <= lats) & (lats <= max_lat)
+        flags += [inside[:-1][valid], inside[1:][valid]]
+    return count_flows(hours[:-1][valid], np.ones(int(valid.sum())), *flags)
+
+def point_cells(lngs, lats):
+    """返回每个点所在的转移表网格编号（行优先），范围外为 OUTSIDE_CELL"""
+    cols = np.floor((lngs - BEIJING_BOUNDS['min_lng']) / TRANSITION_GRID_SIZE).astype(np.int64)
+    rows = np.floor((lats - BEIJING_BOUNDS['min_lat']) / TRANSITION_GRID_SIZE).astype(np.int64)
+    inside = (0 <= cols) & (cols < GRID_COLS) & (0 <= rows) & (rows < GRID_ROWS)
+    return np.where(inside, rows * GRID_COLS + cols, OUTSIDE_CELL)
+
+def transition_partition(args):
+    """
+    统计 [start, end) 区间内同一车辆、同一小时相邻两点的网格转移（在子进程中执行）
+    Returns:
+        (keys, counts, cells): 本区间去重后的转移键及计数，以及每个点的网格编号
+    """
+    store_dir, start, end, first_bucket, bucket_count = args
+    store = attach_store(store_dir)
+    epoch, lngs, lats = store.gcj_columns(start, end)
+    cells = point_cells(lngs, lats)
+    hours = hour_of_day(epoch)
+    taxi_ids = np.asarray(store.taxi_id[start:end])
+    valid = (taxi_ids[1:] == taxi_ids[:-1]) & (hours[1:] == hours[:-1])
+    # 转移键按 (起点网格, 终点网格, 前一点的时间桶) 排序
+    buckets = time_bucket(epoch[:-1][valid]) - first_bucket
+    keys = (cells[:-1][valid] * (OUTSIDE_CELL + 1) + cells[1:][valid]) * bucket_count + buckets
+    keys, counts = np.unique(keys, return_counts=True)
+    return keys, counts, cells.astype(np.int32)
+
+def build_transitions(store):
+    """
+    预计算稀疏转移表 (起点网格, 终点网格, 时间桶) -> 次数，以及按网格排序的点位置（用于边界网格的精确统计）
+    Returns:
+        dict: 字段名 -> 数组
+    """
+    first_bucket = int(time_bucket(np.min(store.epoch))) if len(store) else 0
+    bucket_count = int(time_bucket(np.max(store.epoch))) - first_bucket + 1 if len(store) else 1
+    # 空存储没有区间，在本进程中统计一个空区间，得到结构相同的空转移表
+    parts = map_partitions(transition_partition, store, first_bucket, bucket_count) or \
+        [transition_partition((store.path, 0, 0, first_bucket, bucket_count))]
+
+    keys, inverse = np.unique(np.concatenate([part[0] for part in parts]), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([part[1] for part in parts])).astype(np.int64)
+    pairs, buckets = np.divmod(keys, bucket_count)
+    from_cells, to_cells = np.divmod(pairs, OUTSIDE_CELL + 1)
+    cells = np.concatenate([part[2] for part in parts])
+    point_order = np.argsort(cells, kind='stable')
+    return {
+        "from_cell": from_cells.astype(np.int32),
+        "to_cell": to_cells.astype(np.int32),
+        "bucket": (buckets + first_bucket).astype(np.int32),
+        "count": counts,
+        "to_order": np.argsort(to_cells, kind='stable'),
+        "point_order": point_order,
+        "point_cells": cells[point_order]
+    }
+
+def load_transitions(store):
+    """读取转移表，不存在或与存储不一致时重新统计并落盘（每个进程只加载一次）"""
+    with _transition_lock:
+        if store.path in _transition_tables:
+            return _transition_tables[store.path]
+
+        table_file = os.path.join(store.path, TRANSITION_FILE)
+        meta_file = os.path.join(store.path, TRANSITION_META_FILE)
+        expected = {"grid_size": TRANSITION_GRID_SIZE, "bounds": BEIJING_BOUNDS, "bucket_seconds": TIME_BUCKET_SECONDS,
+                    "source": store.meta["source"]}
+        table = None
+        if os.path.exists(table_file) and os.path.exists(meta_file):
+            with open(meta_file) as f:
+                if json.load(f) == expected:
+                    with np.load(table_file) as data:
+                        table = {name: data[name] for name in TRANSITION_FIELDS}
+        if table is None:
+            table = build_transitions(store)
+            np.savez(table_file, **table)
+            with open(meta_file, 'w') as f:
+                json.dump(expected, f)
+        table["to_cells_sorted"] = table["to_cell"][table["to_order"]]
+        table["hour"] = bucket_hours(table["bucket"]).astype(np.int8)
+        _transition_tables[store.path] = table
+        return table
+
+def area_cell_range(area):
+    """
+    返回矩形覆盖的网格行列范围 (r0, r1, c0, c1)（闭区间，已裁剪到网格内，无交集时为None），
+    以及矩形是否超出网格范围
+    """
+    min_lng, max_lng, min_lat, max_lat = area
+    c0 = math.floor((min_lng - BEIJING_BOUNDS['min_lng']) / TRANSITION_GRID_SIZE)
+    c1 = math.floor((max_lng - BEIJING_BOUNDS['min_lng']) / TRANSITION_GRID_SIZE)
+    r0 = math.floor((min_lat - BEIJING_BOUNDS['min_lat']) / TRANSITION_GRID_SIZE)
+    r1 = math.floor((max_lat - BEIJING_BOUNDS['min_lat']) / TRANSITION_GRID_SIZE)
+    exceeds = c0 < 0 or r0 < 0 or c1 >= GRID_COLS or r1 >= GRID_ROWS
+    c0, c1, r0, r1 = max(c0, 0), min(c1, GRID_COLS - 1), max(r0, 0), min(r1, GRID_ROWS - 1)
+    if c0 > c1 or r0 > r1:
+        return None, exceeds
+    return (r0, r1, c0, c1), exceeds
+
+def full_cell_ranges(cell_range):
+    """完全位于矩形内部的网格，按行给出的 [起始编号, 结束编号) 区间"""
+    r0, r1, c0, c1 = cell_range
+    rows = np.arange(r0 + 1, r1)
+    if c1 - c0 < 2 or not len(rows):
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.stack([rows * GRID_COLS + c0 + 1, rows * GRID_COLS + c1], axis=1)
+
+def border_cell_ranges(cell_range):
+    """矩形边界经过的网格（可能部分位于矩形内），按行给出的 [起始编号, 结束编号) 区间"""
+    r0, r1, c0, c1 = cell_range
+    rows = np.arange(r0, r1 + 1)
+    edge_rows = (rows == r0) | (rows == r1)
+    # 首末行整行，中间行只取左右两列
+    left = np.stack([rows * GRID_COLS + c0, rows * GRID_COLS + np.where(edge_rows, c1, c0) + 1], axis=1)
+    right = np.stack([rows * GRID_COLS + c1, rows * GRID_COLS + c1 + 1], axis=1)[~edge_rows & (c1 > c0)]
+    return np.concatenate([left, right])
+
+def gather_sorted(sorted_values, ranges):
+    """返回有序数组中落在各 [lo, hi) 区间内元素的下标"""
+    if not len(ranges):
+        return np.zeros(0, dtype=np.int64)
+    lo = np.searchsorted(sorted_values, ranges[:, 0])
+    hi = np.searchsorted(sorted_values, ranges[:, 1])
+    lengths = hi - lo
+    return np.repeat(lo - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+def sorted_distinct(values):
+    """排序去重（比 np.unique 的散列实现更快）"""
+    values = np.sort(values)
+    return values[np.concatenate(([True], values[1:] != values[:-1]))] if len(values) else values
+
+def cell_status(cells, area_range):
+    """
+    判断网格相对矩形的位置
+    Returns:
+        (full, partial): 完全在矩形内、被矩形边界穿过（需逐点精确判断）的标记
+    """
+    cell_range, exceeds = area_range
+    outside = cells == OUTSIDE_CELL
+    if cell_range is None:
+        return np.zeros(len(cells), dtype=bool), outside & exceeds
+    r0, r1, c0, c1 = cell_range
+    rows, cols = np.divmod(cells, GRID_COLS)
+    covered = ~outside & (r0 <= rows) & (rows <= r1) & (c0 <= cols) & (cols <= c1)
+    full = covered & (r0 < rows) & (rows < r1) & (c0 < cols) & (cols < c1)
+    return full, (covered & ~full) | (outside & exceeds)
+
+def count_flows(hours, weights, prev_in_a1, in_a1, prev_in_a2=None, in_a2=None):
+    """
+    按与逐点扫描相同的规则统计相邻两点的流入、流出
+    Returns:
+        np.ndarray: (24, 2) int64 每小时的 [flowIn, flowOut]（权重为浮点时取整）
+    """
+    if prev_in_a2 is None:
+        # 单区域模式
+        flow_in = ~prev_in_a1 & in_a1
+        flow_out = prev_in_a1 & ~in_a1
+    else:
+        # 双区域模式
+        flow_out = prev_in_a1 & in_a2
+        flow_in = ~flow_out & prev_in_a2 & in_a1
+    hours = hours.astype(np.int64)
+    # 没有点对时 bincount 返回 int64，有点对时返回 float64，统一为 int64 以便两部分相加
+    return np.rint(np.stack([np.bincount(hours[flow_in], weights=weights[flow_in], minlength=24),
+                             np.bincount(hours[flow_out], weights=weights[flow_out], minlength=24)],
+                            axis=1)).astype(np.int64)
+
+def query_flows(store, table, area1, area2=None, window=None):
+    """
+    由转移表回答区域流量查询：两端网格都不被矩形边界穿过的转移直接按网格求和，
+    涉及边界网格的相邻点对按坐标逐点精确判断
+    Args:
+        window: 可选，TimeWindow 时间窗口，按前一点所在的时间桶筛选
+    Returns:
+        np.ndarray: (24, 2) 每小时的 [flowIn, flowOut]
+    """
+    areas = [area1] + ([area2] if area2 else [])
+    ranges = [area_cell_range(area) for area in areas]
+
+    # 转移表部分：只有一端完全位于某个矩形内的转移可能计入流量
+    from_ranges = np.concatenate([full_cell_ranges(r) for r, _ in ranges if r is not None] +
+                                 [np.zeros((0, 2), dtype=np.int64)])
+    entries = sorted_distinct(np.concatenate([gather_sorted(table["from_cell"], from_ranges),
+                                        table["to_order"][gather_sorted(table["to_cells_sorted"], from_ranges)]]))
+    from_cells, to_cells = table["from_cell"][entries], table["to_cell"][entries]
+    flags, exact = [], np.zeros(len(entries), dtype=bool)
+    for area_range in ranges:
+        from_full, from_partial = cell_status(from_cells, area_range)
+        to_full, to_partial = cell_status(to_cells, area_range)
+        flags += [from_full, to_full]
+        exact |= from_partial | to_partial
+    keep = ~exact
+    if window is not None:
+        keep &= window.bucket_mask(table["bucket"][entries])
+    flows = count_flows(table["hour"][entries][keep], table["count"][entries][keep].astype(np.float64),
+                        *(flag[keep] for flag in flags))
+
+    # 精确部分：至少一端位于边界网格的相邻点对
+    border_ranges = [border_cell_ranges(r) for r, _ in ranges if r is not None]
+    if any(exceeds for _, exceeds in ranges):
+        border_ranges.append(np.array([[OUTSIDE_CELL, OUTSIDE_CELL + 1]]))
+    border_ranges.append(np.zeros((0, 2), dtype=np.int64))
+    points = table["point_order"][gather_sorted(table["point_cells"], np.concatenate(border_ranges))]
+    pairs = sorted_distinct(np.concatenate([points - 1, points]))
+    pairs = pairs[(pairs >= 0) & (pairs < len(store) - 1)]
+    if len(pairs):
+        ends = pairs + 1
+        prev_hours = hour_of_day(store.epoch[pairs])
+        valid = (store.taxi_id[pairs] == store.taxi_id[ends]) & (prev_hours == hour_of_day(store.epoch[ends]))
+        if window is not None:
+            valid &= window.point_mask(store.epoch[pairs])
+        pairs, ends, prev_hours = pairs[valid], ends[valid], prev_hours[valid]
+        flags = []
+        for area in areas:
+            min_lng, max_lng, min_lat, max_lat = area
+            for index in (pairs, ends):
+                lngs = store.lng_gcj[index] / COORD_SCALE
+                lats = store.lat_gcj[index] / COORD_SCALE
+                flags.append((min_lng <= lngs) & (lngs <= max_lng) & (min_lat <= lats) & (lats <= max_lat))
+        flows += count_flows(prev_hours, np.ones(len(pairs)), *flags)
+    return flows
 
 @app.route('/flow_analysis', methods=['GET'])
 def analyze_flow():
-    """优化后的API端点"""
+    """
+    区域流量分析：单区域（F6）统计进出区域的流量，双区域（F5）统计两区域之间的流量
+
+    请求参数：
+        area1, area2: "min_lng,max_lng,min_lat,max_lat"，area2 可选
+        folder_path: 可选，数据目录
+        startTime, endTime: 可选，时间窗口 "YYYY-MM-DD HH:MM:SS"，按15分钟时间桶对齐（按相邻两点中前一点的时间计）
+        weekdays: 可选，只统计星期几，如 "0,1,2,3,4"（0为星期一）
+        mode: 可选，index（默认，由预计算的转移表回答）或 scan（在常驻进程池中扫描轨迹点，
+              按出租车目录的每小时外接矩形跳过同一小时内不可能同时经过各区域的车辆）
+    """
     try:
         start_time = time.time()
         
@@ -109,46 +299,56 @@ def analyze_flow():
         area1 = tuple(map(float, request.args['area1'].split(',')))
         area2 = tuple(map(float, request.args.get('area2', '').split(','))) if 'area2' in request.args else None
         folder_path = request.args.get('folder_path', 'taxi_log_2008_by_id')
-        workers = min(int(request.args.get('workers', cpu_count())), cpu_count())
-        
-        # 创建共享内存
-        shm, flow_array = create_shared_flow_array()
-        
-        try:
-            # 准备任务
-            files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) 
-                    if f.endswith('.txt')]
-            args = [(f, area1, area2, shm.name) for f in files]
-            
-            # 并行处理（使用imap_unordered减少内存占用）
-            with Pool(workers) as pool:
-                for _ in pool.imap_unordered(process_file_optimized, args, chunksize=10):
-                    pass
-            
-            # 生成响应
-            output = []
-            for hour in range(24):
-                output.append({
-                    "hour": hour,
-                    "flowIn": int(flow_array[hour][0]),
-                    "flowOut": int(flow_array[hour][1]),
-                    "netFlow": int(flow_array[hour][0] - flow_array[hour][1])
-                })
-            
+        mode = request.args.get('mode', 'index')
+        window = parse_time_window(request.args)
+
+        if mode == 'index':
+            store = open_store(resolve_data_dir(folder_path))
+            flows = query_flows(store, load_transitions(store), area1, area2, window)
             return jsonify({
                 "status": "success",
                 "processingTime": round(time.time() - start_time, 2),
-                "data": output,
+                "data": [{
+                    "hour": hour,
+                    "flowIn": int(flows[hour][0]),
+                    "flowOut": int(flows[hour][1]),
+                    "netFlow": int(flows[hour][0] - flows[hour][1])
+                } for hour in range(24)],
                 "params": {
                     "area1": area1,
                     "area2": area2 if area2 else None,
-                    "workersUsed": workers
+                    "startTime": request.args.get('startTime'),
+                    "endTime": request.args.get('endTime'),
+                    "weekdays": window.weekdays if window else None,
+                    "mode": mode
                 }
             })
-        
-        finally:
-            shm.close()
-            shm.unlink()
+
+        # 只划分可能产生流量的车辆，各进程返回本区间的计数，在主进程中汇总一次
+        store = open_store(resolve_data_dir(folder_path))
+        taxis = load_catalog(store).hourly_candidates([area1, area2] if area2 else [area1])
+        flows = sum(map_partitions(process_file_optimized, store, area1, area2, window, taxis=taxis),
+                    np.zeros((24, 2), dtype=np.int64))
+
+        return jsonify({
+            "status": "success",
+            "processingTime": round(time.time() - start_time, 2),
+            "data": [{
+                "hour": hour,
+                "flowIn": int(flows[hour][0]),
+                "flowOut": int(flows[hour][1]),
+                "netFlow": int(flows[hour][0] - flows[hour][1])
+            } for hour in range(24)],
+            "params": {
+                "area1": area1,
+                "area2": area2 if area2 else None,
+                "startTime": request.args.get('startTime'),
+                "endTime": request.args.get('endTime'),
+                "weekdays": window.weekdays if window else None,
+                "workersUsed": POOL_WORKERS,
+                "taxisScanned": len(taxis)
+            }
+        })
     
     except Exception as e:
         return jsonify({
@@ -1,74 +1,206 @@
-import datetime
-
 from flask import Flask, request, jsonify
-import sqlite3
-import math
-from collections import defaultdict, Counter
-from coordTransform import wgs84_to_gcj02
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from heavy_hitters import CountMinTopK
+from service import map_partitions, POOL_WORKERS
+from trajectory_store import BEIJING_BOUNDS, DATA_DIR, attach_store, open_store, to_timestamp
+from trip_segmentation import TRIP_GAP_SECONDS, path_length
 
 app = Flask(__name__)
-DB_PATH = "trajectory.db"
 
-def transform_wgs84_to_gcj02_point(lng, lat):
-    lng_gcj, lat_gcj = wgs84_to_gcj02(lng, lat)
-    return lng_gcj, lat_gcj
-# 经纬度转换为大致距离（单位：米）
-def haversine(lat1, lng1, lat2, lng2):
+# 路径匹配网格大小（度，约200米）
+CELL_SIZE = 0.002
+# 统计的连续网格片段（n-gram）长度
+NGRAM_LENGTH = 6
+# 相邻两点跨越超过该网格数时视为断点（GPS漂移或长时间缺失）
+MAX_STEP_CELLS = 50
+# 拼接路径时，后继片段的计数至少为种子片段计数的该比例
+EXTEND_RATIO = 0.8
+# 候选片段表容量
+CANDIDATE_CAPACITY = 20000
+# 每个工作进程内每批处理的轨迹点数
+BATCH_POINTS = 1000000
+
+GRID_COLS = int((BEIJING_BOUNDS['max_lng'] - BEIJING_BOUNDS['min_lng']) / CELL_SIZE) + 1
+
+def cell_center(cells):
     """
-    使用Haversine公式计算两个经纬度点之间的距离
+    返回网格中心坐标
 
     参数：
-        lat1 (float): 第一个点的纬度
-        lng1 (float): 第一个点的经度
-        lat2 (float): 第二个点的纬度
-        lng2 (float): 第二个点的经度
+        cells (np.ndarray): 网格编号数组
 
     返回：
-        float: 两点之间的距离（单位：米）
+        tuple: (经度数组, 纬度数组)
     """
-    R = 6371000  # 地球半径，单位米
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lng2 - lng1)
-    a = math.sin(delta_phi / 2) ** 2 + \
-        math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
-    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-def path_distance(trail):
+    rows, cols = np.divmod(cells, GRID_COLS)
+    return (BEIJING_BOUNDS['min_lng'] + (cols + 0.5) * CELL_SIZE,
+            BEIJING_BOUNDS['min_lat'] + (rows + 0.5) * CELL_SIZE)
+
+def match_to_cells(taxi_ids, epoch, lngs, lats):
     """
-    计算轨迹的总距离
+    将一批按车辆、时间排序的轨迹点匹配为连续网格序列
+
+    相邻两点之间按直线插值补齐经过的网格（时间线性插值），并去掉连续重复的网格。
+    换车、时间间隔超过 TRIP_GAP_SECONDS 或跨越超过 MAX_STEP_CELLS 个网格处断开。
 
     参数：
-        trail (list): 轨迹点列表，每个点包含lat和lng字段
+        taxi_ids, epoch, lngs, lats (np.ndarray): 轨迹点列（GCJ02坐标）
 
     返回：
-        float: 轨迹的总距离（单位：米）
+        tuple: (网格编号, 时间, 断点标记)，断点标记为True处开始一个新序列
+    """
+    inside = ((BEIJING_BOUNDS['min_lng'] <= lngs) & (lngs < BEIJING_BOUNDS['max_lng']) &
+              (BEIJING_BOUNDS['min_lat'] <= lats) & (lats < BEIJING_BOUNDS['max_lat']))
+    taxi_ids, epoch = taxi_ids[inside], epoch[inside].astype(np.float64)
+    cols = ((lngs[inside] - BEIJING_BOUNDS['min_lng']) / CELL_SIZE).astype(np.int64)
+    rows = ((lats[inside] - BEIJING_BOUNDS['min_lat']) / CELL_SIZE).astype(np.int64)
+    if not len(rows):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty.astype(np.float64), empty.astype(bool)
+
+    prev_rows, prev_cols, prev_epoch = (np.roll(a, 1) for a in (rows, cols, epoch))
+    steps = np.maximum(np.abs(rows - prev_rows), np.abs(cols - prev_cols))
+    breaks = (taxi_ids != np.roll(taxi_ids, 1)) | (epoch - prev_epoch > TRIP_GAP_SECONDS) | (steps > MAX_STEP_CELLS)
+    breaks[0] = True
+    # 断点处以自身为前一点，只输出自身
+    prev_rows = np.where(breaks, rows, prev_rows)
+    prev_cols = np.where(breaks, cols, prev_cols)
+    prev_epoch = np.where(breaks, epoch, prev_epoch)
+    counts = np.where(breaks, 1, np.maximum(steps, 1))
+
+    owner = np.repeat(np.arange(len(rows)), counts)
+    step = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    frac = step / counts[owner]
+    out_rows = prev_rows[owner] + np.rint((rows - prev_rows)[owner] * frac).astype(np.int64)
+    out_cols = prev_cols[owner] + np.rint((cols - prev_cols)[owner] * frac).astype(np.int64)
+    out_epoch = prev_epoch[owner] + (epoch - prev_epoch)[owner] * frac
+    out_breaks = breaks[owner] & (step == 1)
+
+    cells = out_rows * GRID_COLS + out_cols
+    keep = out_breaks | (cells != np.roll(cells, 1))
+    return cells[keep], out_epoch[keep], out_breaks[keep]
+
+def ngram_hashes(cells, breaks, n):
     """
-    total = 0
-    for i in range(1, len(trail)):
-        total += haversine(trail[i-1]['lat'], trail[i-1]['lng'], trail[i]['lat'], trail[i]['lng'])
-    return total
+    计算同一序列内所有长度为n的连续网格片段的散列值
 
-# 网格化轨迹编码（简化聚类）
-def encode_path(trail, grid_size=0.001):
+    返回：
+        tuple: (片段起始位置, uint64散列值)
+    """
+    if len(cells) < n:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+    sequence = np.cumsum(breaks)
+    starts = np.flatnonzero(sequence[:len(cells) - n + 1] == sequence[n - 1:])
+    windows = sliding_window_view(cells.astype(np.uint64) + np.uint64(1), n)[starts]
+    hashes = np.zeros(len(starts), dtype=np.uint64)
+    for j in range(n):
+        hashes = hashes * np.uint64(1099511628211) + windows[:, j]
+    return starts, hashes
+
+def ngram_partition(args):
+    """
+    统计 [start, end) 区间的频繁网格片段（在子进程中执行），区间内按出租车边界分批扫描
+    Returns:
+        CountMinTopK: 该区间的频繁片段统计
     """
-    对轨迹进行网格化编码
+    path, start, end, n, capacity = args
+    store = attach_store(path)
+    counter = CountMinTopK(capacity)
+    first, last = np.searchsorted(store.offsets, [start, end])
+    batches = max(1, -(-(end - start) // BATCH_POINTS))
+    for batch_start, batch_end in store.partitions(batches, np.arange(first, last)):
+        epoch, lngs, lats = store.gcj_columns(batch_start, batch_end)
+        cells, times, breaks = match_to_cells(np.asarray(store.taxi_id[batch_start:batch_end]), epoch, lngs, lats)
+        starts, hashes = ngram_hashes(cells, breaks, n)
+        new_items, first_index = counter.add(hashes)
+        for item, i in zip(new_items.tolist(), starts[first_index].tolist()):
+            counter.track(item, (cells[i:i + n].copy(), times[i:i + n].copy()))
+    return counter
+
+def count_ngrams(store, n=NGRAM_LENGTH, capacity=CANDIDATE_CAPACITY):
+    """
+    在常驻进程池中分区间扫描列式存储，合并各区间的频繁网格片段统计
 
     参数：
-        trail (list): 轨迹点列表
-        grid_size (float): 网格大小，默认0.001
+        store: 列式轨迹存储
+        n (int): 片段长度
+        capacity (int): 候选片段表容量
 
     返回：
-        tuple: 网格化编码后的轨迹
+        CountMinTopK: 附加数据为 (网格编号数组, 时间数组) 的频繁片段统计
+    """
+    # 每个区间返回一份完整的 sketch，区间数与进程数相同以减少进程间传输；空存储在本进程中统计一个空区间
+    parts = (map_partitions(ngram_partition, store, n, capacity, parts=POOL_WORKERS)
+             or [ngram_partition((store.path, 0, 0, n, capacity))])
+    counter = parts[0]
+    for part in parts[1:]:
+        counter.merge(part)
+    return counter
+
+def assemble_paths(candidates, top_k, min_distance):
     """
-    return tuple((round(p['lat']/grid_size), round(p['lng']/grid_size)) for p in trail)
+    从频繁片段拼接Top-K路径
+
+    以计数最高的片段为种子，向前、向后反复接上重叠 n-1 个网格且计数不低于
+    EXTEND_RATIO 倍种子计数的片段，保留长度不小于 min_distance 的路径。
+
+    参数：
+        candidates (list): [(散列值, 计数, (网格编号, 时间))]，按计数降序
+        top_k (int): 返回路径数
+        min_distance (float): 最小路径长度（米）
+
+    返回：
+        list: [(支持度, 网格编号列表, 时间列表)]
+    """
+    by_prefix, by_suffix = {}, {}
+    for item, count, (cells, times) in candidates:
+        by_prefix.setdefault(tuple(cells[:-1].tolist()), (item, count, cells, times))
+        by_suffix.setdefault(tuple(cells[1:].tolist()), (item, count, cells, times))
+
+    used, covered, paths = set(), set(), []
+    for item, count, (cells, times) in candidates:
+        if len(paths) >= top_k:
+            break
+        seed_cells = cells.tolist()
+        if item in used or sum(c in covered for c in seed_cells) * 2 > len(seed_cells):
+            continue
+        used.add(item)
+        path_cells, path_times, support = list(seed_cells), times.tolist(), count
+
+        while True:
+            nxt = by_prefix.get(tuple(path_cells[len(path_cells) - len(seed_cells) + 1:]))
+            if nxt is None or nxt[0] in used or nxt[1] < EXTEND_RATIO * count or nxt[2][-1] in path_cells:
+                break
+            used.add(nxt[0])
+            support = min(support, nxt[1])
+            path_cells.append(int(nxt[2][-1]))
+            path_times.append(path_times[-1] + float(nxt[3][-1] - nxt[3][-2]))
+
+        while True:
+            prv = by_suffix.get(tuple(path_cells[:len(seed_cells) - 1]))
+            if prv is None or prv[0] in used or prv[1] < EXTEND_RATIO * count or prv[2][0] in path_cells:
+                break
+            used.add(prv[0])
+            support = min(support, prv[1])
+            path_cells.insert(0, int(prv[2][0]))
+            path_times.insert(0, path_times[0] - float(prv[3][1] - prv[3][0]))
+
+        lngs, lats = cell_center(np.array(path_cells))
+        if path_length(lngs, lats) >= min_distance:
+            covered.update(path_cells)
+            paths.append((support, path_cells, path_times))
+    return paths
 
 @app.route('/frequent_paths', methods=['POST'])
 def frequent_paths():
     """
     处理频繁路径查询请求
 
+    轨迹点匹配为网格序列后，用 Count-Min Sketch 统计所有车辆共有的连续网格片段，
+    候选表只保留最频繁的片段，再拼接为长度不小于 minDistance 的Top-K路径。
+    内存占用由 sketch 与候选表容量决定，与数据集大小无关。
+
     请求参数（JSON）：
         {
             "minDistance": 最小距离（单位：米，默认1000）,
@@ -76,67 +208,28 @@ def frequent_paths():
         }
 
     返回：
-        JSON响应：包含最频繁路径的JSON对象
+        JSON响应：包含最频繁路径的JSON对象，vender 为路径支持度（经过该路径的次数）
     """
     req = request.get_json()
     min_distance = req.get("minDistance", 1000)  # 单位：米
     top_k = req.get("k", 5)
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT taxi_id, time, lng, lat FROM traj_data ORDER BY taxi_id, time")
-    rows = cursor.fetchall()
-    conn.close()
-
-    current_id = None
-    current_trail = []
-
-    path_counter = Counter()
-    path_samples = {}
-
-    def add_trail_if_valid(trail):
-        if len(trail) >= 2 and path_distance(trail) >= min_distance:
-            key = encode_path(trail)
-            path_counter[key] += 1
-            if key not in path_samples:
-                path_samples[key] = trail[:]
-
-    for taxi_id, time, lng, lat in rows:
-        lng_gcj, lat_gcj = transform_wgs84_to_gcj02_point(lng, lat)
-        point = {"lat": lat_gcj, "lng": lng_gcj, "time": time}
-        # point = [lat_gcj, lng_gcj, datetime.datetime.strptime(time, "%Y-%m-%d %H:%M:%S").timestamp()]
-
-        if taxi_id != current_id:
-            add_trail_if_valid(current_trail)
-            current_trail = [point]
-            current_id = taxi_id
-        else:
-            current_trail.append(point)
-
-    # 处理最后一个轨迹
-    add_trail_if_valid(current_trail)
-
-    # 获取 Top-K
-    top_paths = path_counter.most_common(top_k)
+    candidates = count_ngrams(open_store(DATA_DIR)).items()
+    paths = assemble_paths(candidates, top_k, min_distance)
 
     result = []
-    for path_key, count in top_paths:
-        sample_trail = path_samples[path_key]
+    for support, cells, times in paths:
+        lngs, lats = (np.round(v, 6) for v in cell_center(np.array(cells)))
         result.append({
-            "vender": count,
-            "path": [[
-                p['lat'],
-                p['lng'],
-                datetime.datetime.strptime(p['time'],"%Y-%m-%d %H:%M:%S").timestamp()
-            ] for p in sample_trail]
+            "vender": support,
+            "path": [[lat, lng, timestamp]
+                     for lat, lng, timestamp in zip(lats.tolist(), lngs.tolist(), to_timestamp(np.rint(times)).tolist())]
         })
 
     return jsonify({
-        "total": len(path_counter),
+        "total": len(candidates),
         "topK": top_k,
         "result": result
     })
 if __name__ == '__main__':
     app.run(debug=True)
-
@@ -1,113 +1,56 @@
 from flask import Flask, request, jsonify
-import os
-from datetime import datetime
-from multiprocessing import Pool, cpu_count, Manager
+import numpy as np
 from coordTransform_utils import wgs84_to_gcj02
+from trajectory_store import DATA_DIR, COORD_SCALE, open_store, resolve_data_dir, hour_of_day
+from trip_index import load_trip_index, find_passages
 import time
 
 app = Flask(__name__)
 
-class TrajectoryAnalyzer:
-    __slots__ = ['hour', 'entry_time', 'exit_time', 'path']
-    
-    def __init__(self, hour=None):
-        self.hour = hour
-        self.entry_time = None
-        self.exit_time = None
-        self.path = []
-
-def parse_timestamp(time_str):
-    """安全解析时间戳"""
-    try:
-        return datetime.strptime(time_str, "%Y-%m-%d %H:%M:%S")
-    except ValueError:
-        return None
-
-def process_trajectory(args):
-    """健壮的轨迹处理函数"""
-    filename, area1, area2, target_hour, result_dict = args
-    local_stats = {}
-    
-    try:
-        with open(filename, 'r') as f:
-            current_taxi = None
-            analyzer = None
-            
-            for line in f:
-                parts = line.strip().split(',', 3)
-                if len(parts) < 4:
-                    continue
-                
-                try:
-                    taxi_id = parts[0]
-                    time_str = parts[1]
-                    lng, lat = wgs84_to_gcj02(float(parts[2]), float(parts[3]))
-                    hour = int(time_str[11:13])
-                    
-                    # 时间过滤
-                    if target_hour is not None and hour != target_hour:
-                        continue
-                    
-                    if taxi_id != current_taxi:
-                        if analyzer is not None:  # 明确检查None
-                            update_stats(analyzer, local_stats)
-                        current_taxi = taxi_id
-                        analyzer = TrajectoryAnalyzer(hour)
-                    
-                    # 确保analyzer已初始化
-                    if analyzer is None:
-                        continue
-                    
-                    # 区域判断
-                    in_area1 = (area1[0] <= lng <= area1[1]) and (area1[2] <= lat <= area1[3])
-                    in_area2 = (area2[0] <= lng <= area2[1]) and (area2[2] <= lat <= area2[3])
-                    
-                    if not analyzer.path and in_area1:
-                        analyzer.entry_time = parse_timestamp(time_str)
-                        if analyzer.entry_time:  # 时间解析成功
-                            analyzer.path.append((lng, lat))
-                    elif analyzer.path:
-                        analyzer.path.append((lng, lat))
-                        if in_area2:
-                            analyzer.exit_time = parse_timestamp(time_str)
-                            if analyzer.exit_time:  # 时间解析成功
-                                update_stats(analyzer, local_stats)
-                            analyzer = None
-                
-                except (ValueError, IndexError):
-                    continue
-            
-            # 最终检查未处理的轨迹
-            if analyzer is not None and analyzer.path:
-                update_stats(analyzer, local_stats)
-    
-    except Exception as e:
-        print(f"处理文件 {filename} 时出错: {str(e)}")
-    
-    # 合并结果
-    for hour, stats in local_stats.items():
-        if hour not in result_dict or stats['time'] < result_dict[hour]['time']:
-            result_dict[hour] = stats
+def hourly_travel_stats(store, entry, exit_):
+    """
+    按进入区域1的小时统计通行时间分布
+    Args:
+        store: 列式轨迹存储
+        entry, exit_: 通行起止点在存储中的位置数组
+    Returns:
+        dict: 小时 -> {'min', 'median', 'p90'（分钟）, 'count', 'path': 最快通行的轨迹}
+    """
+    entry_epoch = np.asarray(store.epoch[entry], dtype=np.int64)
+    minutes = (np.asarray(store.epoch[exit_], dtype=np.int64) - entry_epoch) / 60
+    hours = hour_of_day(entry_epoch)
 
-def update_stats(analyzer, stats_dict):
-    """安全更新统计结果"""
-    if (analyzer is not None and analyzer.path and 
-        analyzer.entry_time and analyzer.exit_time):
-        travel_time = (analyzer.exit_time - analyzer.entry_time).total_seconds() / 60
-        hour = analyzer.hour
-        
-        if hour not in stats_dict or travel_time < stats_dict[hour]['time']:
-            stats_dict[hour] = {
-                'path': analyzer.path.copy(),
-                'time': round(travel_time, 2),  # 保留2位小数
-                'count': 1
-            }
-        elif travel_time == stats_dict[hour]['time']:
-            stats_dict[hour]['count'] += 1
+    stats = {}
+    for hour in np.unique(hours).tolist():
+        selected = np.flatnonzero(hours == hour)
+        values = minutes[selected]
+        fastest = selected[np.argmin(values)]
+        start, end = int(entry[fastest]), int(exit_[fastest]) + 1
+        path = list(zip((store.lng_gcj[start:end] / COORD_SCALE).tolist(),
+                        (store.lat_gcj[start:end] / COORD_SCALE).tolist()))
+        stats[hour] = {
+            'min': round(float(values.min()), 2),  # 保留2位小数
+            'median': round(float(np.median(values)), 2),
+            'p90': round(float(np.percentile(values, 90)), 2),
+            'count': len(values),
+            'path': path
+        }
+    return stats
 
 @app.route('/api/shortest_path', methods=['GET'])
 def analyze_shortest_path():
-    """健壮的API端点"""
+    """
+    区域1到区域2的通行时间分析
+
+    请求参数：
+        area1, area2: "min_lng,max_lng,min_lat,max_lat"
+        hour: 可选，只统计在该小时进入区域1的通行
+        folder_path: 可选，数据目录
+
+    返回：
+        每小时的通行时间分布（分钟）：travel_time 为最短时间，median_time、p90_time 为中位数与90分位数，
+        sample_count 为通行次数，path 为最快一次通行的轨迹
+    """
     start_time = time.time()
     
     try:
@@ -115,7 +58,7 @@ def analyze_shortest_path():
         area1 = tuple(map(float, request.args['area1'].split(',')))
         area2 = tuple(map(float, request.args['area2'].split(',')))
         target_hour = int(request.args['hour']) if 'hour' in request.args else None
-        folder_path = request.args.get('folder_path', 'GO')
+        folder_path = request.args.get('folder_path', DATA_DIR)
         
         # 坐标转换
         def convert_area(area):
@@ -130,45 +73,32 @@ def analyze_shortest_path():
         area1 = convert_area(area1)
         area2 = convert_area(area2)
         
-        # 并行处理
-        with Manager() as manager:
-            result_dict = manager.dict()
-            files = [os.path.join(folder_path, f) 
-                    for f in os.listdir(folder_path) 
-                    if f.endswith('.txt')]
-            
-            workers = min(cpu_count(), 4)
-            with Pool(workers) as pool:
-                pool.map(process_trajectory,
-                        [(f, area1, area2, target_hour, result_dict) for f in files],
-                        chunksize=5)
-            
-            # 构建响应
-            response_data = []
-            if target_hour is not None:
-                stats = result_dict.get(target_hour, {'path': None, 'time': -1, 'count': 0})
-                response_data.append({
-                    "hour": target_hour,
-                    "path": stats['path'],
-                    "travel_time": stats['time'],
-                    "sample_count": stats['count']
-                })
-            else:
-                for hour in range(24):
-                    stats = result_dict.get(hour, {'path': None, 'time': -1, 'count': 0})
-                    response_data.append({
-                        "hour": hour,
-                        "path": stats['path'],
-                        "travel_time": stats['time'],
-                        "sample_count": stats['count']
-                    })
-            
-            return jsonify({
-                "status": "success",
-                "data": response_data,
-                "process_time": round(time.time() - start_time, 2)
+        # 行程索引定位候选行程，只读取候选行程的轨迹点
+        store = open_store(resolve_data_dir(folder_path))
+        entry, exit_ = find_passages(store, load_trip_index(store), area1, area2, target_hour)
+        result = hourly_travel_stats(store, entry, exit_)
+
+        # 构建响应
+        empty = {'path': None, 'min': -1, 'median': -1, 'p90': -1, 'count': 0}
+        hours = [target_hour] if target_hour is not None else range(24)
+        response_data = []
+        for hour in hours:
+            stats = result.get(hour, empty)
+            response_data.append({
+                "hour": hour,
+                "path": stats['path'],
+                "travel_time": stats['min'],
+                "median_time": stats['median'],
+                "p90_time": stats['p90'],
+                "sample_count": stats['count']
             })
-    
+
+        return jsonify({
+            "status": "success",
+            "data": response_data,
+            "process_time": round(time.time() - start_time, 2)
+        })
+
     except Exception as e:
         return jsonify({
             "status": "error",
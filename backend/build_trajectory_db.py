@@ -1,79 +1,260 @@
-import os
+import time
 import sqlite3
-import datetime
+import argparse
+import numpy as np
+from itertools import repeat
+from multiprocessing import Pool, cpu_count
+from trajectory_store import list_taxi_files, parse_log_file
+from coordTransform_utils import wgs84_to_gcj02_array
+from trip_segmentation import segment_trips, encode_cells
 
 DATA_DIR = r".\\taxi_log_2008_by_id"
 DB_PATH = "trajectory.db"
 
-def parse_line(line):
-    parts = line.strip().split(',')
-    if len(parts) != 4:
-        return None
-    try:
-        return {
-            "id": parts[0],
-            "time": parts[1],
-            "lng": float(parts[2]),
-            "lat": float(parts[3])
-        }
-    except:
-        return None
-
-def build_database():
+# 每批写入的轨迹点数
+BATCH_SIZE = 100000
+
+# 导入完成后再创建的二级索引；(taxi_id, time) 供 REGION_QUERY_FOR_TAXI（F3 流式响应）逐车按时间读取
+SECONDARY_INDEXES = [
+    "CREATE INDEX idx_traj_data_taxi_time ON traj_data (taxi_id, time)",
+]
+
+# R-tree 以32位浮点存储坐标，时间维度存为相对 time_base 的秒数，
+# 2^24 秒（约194天）以内可精确表示
+TIME_BASE_KEY = "time_base"
+
+# 区域查询（GCJ02坐标）：经度、纬度、时间三个维度均由 traj_index 的 R-tree 约束
+REGION_QUERY = """
+    SELECT d.taxi_id, d.time, d.lng_gcj, d.lat_gcj
+    FROM traj_index AS i
+    JOIN traj_data AS d ON d.point_id = i.point_id
+    WHERE
+        i.min_lng >= ? AND i.max_lng <= ?
+        AND i.min_lat >= ? AND i.max_lat <= ?
+        AND i.min_t >= ? AND i.max_t <= ?
+"""
+
+# 单辆车的区域查询，供流式响应逐车输出：由 (taxi_id, time) 索引按时间顺序读取该车在时间范围内的点，
+# 再按点ID查 R-tree，约束与 REGION_QUERY 相同，无需对全部结果排序
+REGION_QUERY_FOR_TAXI = """
+    SELECT d.time, d.lng_gcj, d.lat_gcj
+    FROM traj_data AS d
+    CROSS JOIN traj_index AS i ON i.point_id = d.point_id
+    WHERE
+        d.taxi_id = ? AND d.time >= ? AND d.time <= ?
+        AND i.min_lng >= ? AND i.max_lng <= ?
+        AND i.min_lat >= ? AND i.max_lat <= ?
+        AND i.min_t >= ? AND i.max_t <= ?
+    ORDER BY d.time
+"""
+
+# A→B 行程查询（GCJ02坐标）：起点、终点分别由 trip_origin_index、trip_dest_index 的 R-tree 约束
+OD_TRIP_QUERY = """
+    SELECT t.first_point_id, t.last_point_id, t.path
+    FROM trip_origin_index AS o
+    JOIN trip_dest_index AS d ON d.trip_id = o.trip_id
+    JOIN trips AS t ON t.trip_id = o.trip_id
+    WHERE
+        o.min_lng >= ? AND o.max_lng <= ?
+        AND o.min_lat >= ? AND o.max_lat <= ?
+        AND d.min_lng >= ? AND d.max_lng <= ?
+        AND d.min_lat >= ? AND d.max_lat <= ?
+"""
+
+def load_time_base(conn):
+    """读取构建时写入的时间基准（秒）"""
+    row = conn.execute("SELECT value FROM traj_meta WHERE key = ?", (TIME_BASE_KEY,)).fetchone()
+    return int(row[0])
+
+def check_query_plan(conn):
+    """
+    使用 EXPLAIN QUERY PLAN 校验区域查询同时以空间和时间维度走 R-tree 索引，逐车区域查询走 (taxi_id, time) 索引
+    Returns:
+        list: 查询计划描述
+    """
+    plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + REGION_QUERY, (0,) * 6)]
+    # R-tree 的 idxStr 中每个约束为“操作符+列号”，6列（经度、纬度、时间的上下界）应全部出现
+    rtree_scan = next((p for p in plan if "VIRTUAL TABLE INDEX" in p), "")
+    constraints = rtree_scan.rsplit(":", 1)[-1]
+    if sorted(constraints[1::2]) != list("012345"):
+        raise RuntimeError(f"区域查询未使用时空R-tree索引：{plan}")
+    # 逐车查询应由 (taxi_id, time) 索引按时间顺序读取，不需要临时排序
+    taxi_plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + REGION_QUERY_FOR_TAXI, ("",) * 3 + (0,) * 6)]
+    if not any("idx_traj_data_taxi_time" in p for p in taxi_plan) or any("TEMP B-TREE" in p for p in taxi_plan):
+        raise RuntimeError(f"逐车区域查询未使用 (taxi_id, time) 索引：{taxi_plan}")
+    return plan + taxi_plan
+
+def parse_file(args):
+    """
+    解析单个轨迹文件（在子进程中执行）
+    Returns:
+        (taxi_id, epoch, times, lngs, lats, lngs_gcj, lats_gcj, trips): 按时间排序的列数据，
+        trips 为 [(start, end, 编码路径)] 行程切分结果
+    """
+    taxi_id, filepath = args
+    epoch, lngs, lats = parse_log_file(filepath)
+    if not len(epoch):
+        # 空文件或全部为无效行：没有点也没有行程（numpy 2.x 的 np.char.replace 不接受空数组）
+        return str(taxi_id), epoch, [], [], [], [], [], []
+    lngs_gcj, lats_gcj = wgs84_to_gcj02_array(lngs, lats)
+    times = np.char.replace(np.datetime_as_string(epoch.astype('datetime64[s]')), 'T', ' ')
+    trips = [(start, end, encode_cells(lngs_gcj[start:end], lats_gcj[start:end]))
+             for start, end in segment_trips(epoch, lngs_gcj, lats_gcj)]
+    return (str(taxi_id), epoch, times.tolist(), lngs.tolist(), lats.tolist(),
+            lngs_gcj.tolist(), lats_gcj.tolist(), trips)
+
+def apply_build_pragmas(cursor, fast):
+    """导入期间的数据库参数：fast 模式下关闭同步写盘并使用大页缓存"""
+    if fast:
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("PRAGMA cache_size = -1048576")  # 1GB
+        cursor.execute("PRAGMA temp_store = MEMORY")
+
+def build_database(fast=True, workers=None):
+    """
+    构建轨迹数据库
+    Args:
+        fast: 是否使用快速导入模式（WAL、关闭同步写盘、大页缓存）
+        workers: 并行解析文件的进程数，默认为CPU核数
+    """
+    start_time = time.time()
     print("初始化数据库...")
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
+    apply_build_pragmas(cursor, fast)
+
+    # 导入或查询计划校验失败时同样恢复日志模式并关闭连接
+    try:
+        cursor.execute("DROP TABLE IF EXISTS traj_data")
+        cursor.execute("DROP TABLE IF EXISTS traj_index")
+        cursor.execute("DROP TABLE IF EXISTS traj_meta")
+        cursor.execute("DROP TABLE IF EXISTS trips")
+        cursor.execute("DROP TABLE IF EXISTS trip_origin_index")
+        cursor.execute("DROP TABLE IF EXISTS trip_dest_index")
+
+        cursor.execute("""
+            CREATE TABLE traj_data (
+                point_id INTEGER PRIMARY KEY,
+                taxi_id TEXT,
+                time TEXT,
+                lng REAL,
+                lat REAL,
+                lng_gcj REAL,
+                lat_gcj REAL
+            )
+        """)
+
+        # 空间索引建立在GCJ02坐标上，与前端查询矩形一致，查询时无需坐标转换
+
+        cursor.execute("""
+            CREATE VIRTUAL TABLE traj_index USING rtree(
+                point_id,
+                min_lng, max_lng,
+                min_lat, max_lat,
+                min_t, max_t
+            )
+        """)
+
+        cursor.execute("""
+            CREATE TABLE traj_meta (
+                key TEXT PRIMARY KEY,
+                value
+            )
+        """)
+
+        # 行程表：停留/长时间缺失处切分出的行程，点范围引用 traj_data 的连续 point_id，
+        # path 为 0.001 度网格编码（见 trip_segmentation.encode_cells）
+        cursor.execute("""
+            CREATE TABLE trips (
+                trip_id INTEGER PRIMARY KEY,
+                taxi_id TEXT,
+                start_time TEXT,
+                end_time TEXT,
+                first_point_id INTEGER,
+                last_point_id INTEGER,
+                path BLOB
+            )
+        """)
+        cursor.execute("CREATE VIRTUAL TABLE trip_origin_index USING rtree(trip_id, min_lng, max_lng, min_lat, max_lat)")
+        cursor.execute("CREATE VIRTUAL TABLE trip_dest_index USING rtree(trip_id, min_lng, max_lng, min_lat, max_lat)")
 
-    cursor.execute("DROP TABLE IF EXISTS traj_data")
-    cursor.execute("DROP TABLE IF EXISTS traj_index")
-
-    cursor.execute("""
-        CREATE TABLE traj_data (
-            point_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            taxi_id TEXT,
-            time TEXT,
-            lng REAL,
-            lat REAL
-        )
-    """)
-
-    cursor.execute("""
-        CREATE VIRTUAL TABLE traj_index USING rtree(
-            point_id,
-            min_lng, max_lng,
-            min_lat, max_lat
-        )
-    """)
-
-    conn.commit()
-
-    print("开始导入轨迹数据...")
-
-    count = 0
-    for filename in os.listdir(DATA_DIR):
-        if not filename.endswith(".txt"):
-            continue
-        taxi_id = filename.replace(".txt", "")
-        filepath = os.path.join(DATA_DIR, filename)
-        with open(filepath, 'r') as f:
-            for line in f:
-                record = parse_line(line)
-                if not record:
+        conn.commit()
+
+        print("开始导入轨迹数据...")
+
+        data_rows = []
+        index_rows = []
+        trip_rows = []
+        origin_rows = []
+        dest_rows = []
+
+        def flush():
+            cursor.executemany("INSERT INTO traj_data (point_id, taxi_id, time, lng, lat, lng_gcj, lat_gcj) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?)", data_rows)
+            cursor.executemany("INSERT INTO traj_index VALUES (?, ?, ?, ?, ?, ?, ?)", index_rows)
+            cursor.executemany("INSERT INTO trips VALUES (?, ?, ?, ?, ?, ?, ?)", trip_rows)
+            cursor.executemany("INSERT INTO trip_origin_index VALUES (?, ?, ?, ?, ?)", origin_rows)
+            cursor.executemany("INSERT INTO trip_dest_index VALUES (?, ?, ?, ?, ?)", dest_rows)
+            conn.commit()
+            for rows in (data_rows, index_rows, trip_rows, origin_rows, dest_rows):
+                rows.clear()
+
+        # 多进程解析文件，主进程单线程写入；point_id 按导入顺序确定性分配
+        count = 0
+        trip_count = 0
+        time_base = None
+        files = list_taxi_files(DATA_DIR)
+        with Pool(workers or cpu_count()) as pool:
+            for taxi_id, epoch, times, lngs, lats, lngs_gcj, lats_gcj, trips in pool.imap(parse_file, files,
+                                                                                            chunksize=8):
+                if not times:
                     continue
-                cursor.execute("INSERT INTO traj_data (taxi_id, time, lng, lat) VALUES (?, ?, ?, ?)",
-                               (taxi_id, record['time'], record['lng'], record['lat']))
-                point_id = cursor.lastrowid
-                # 插入空间索引
-                cursor.execute("INSERT INTO traj_index VALUES (?, ?, ?, ?, ?)",
-                               (point_id, record['lng'], record['lng'], record['lat'], record['lat']))
-
-                count += 1
-                if count % 100000 == 0:
-                    print(f"已处理 {count} 条轨迹点...")
-                    conn.commit()
-    conn.commit()
-    print("构建完成，总计轨迹点数：", count)
-    conn.close()
+                if time_base is None:
+                    # 以首个文件所在日的零点为基准
+                    time_base = int(epoch[0]) // 86400 * 86400
+                    cursor.execute("INSERT INTO traj_meta VALUES (?, ?)", (TIME_BASE_KEY, time_base))
+                offsets = (epoch - time_base).tolist()
+                point_ids = range(count + 1, count + len(times) + 1)
+                data_rows.extend(zip(point_ids, repeat(taxi_id), times, lngs, lats, lngs_gcj, lats_gcj))
+                index_rows.extend(zip(point_ids, lngs_gcj, lngs_gcj, lats_gcj, lats_gcj, offsets, offsets))
+                for start, end, path in trips:
+                    trip_count += 1
+                    first, last = start, end - 1
+                    trip_rows.append((trip_count, taxi_id, times[first], times[last],
+                                      count + 1 + first, count + 1 + last, path))
+                    origin_rows.append((trip_count, lngs_gcj[first], lngs_gcj[first], lats_gcj[first], lats_gcj[first]))
+                    dest_rows.append((trip_count, lngs_gcj[last], lngs_gcj[last], lats_gcj[last], lats_gcj[last]))
+                count += len(times)
+                if len(data_rows) >= BATCH_SIZE:
+                    flush()
+                    elapsed = time.time() - start_time
+                    print(f"已处理 {count} 条轨迹点（{count / elapsed:.0f} 点/秒）...")
+        flush()
+        load_time = time.time() - start_time
+
+        print("创建二级索引...")
+        for statement in SECONDARY_INDEXES:
+            cursor.execute(statement)
+        cursor.execute("ANALYZE")
+        conn.commit()
+        for line in check_query_plan(conn):
+            print("区域查询计划：", line)
+    finally:
+        conn.rollback()
+        if fast:
+            # 恢复为单文件数据库，便于各查询模块以默认参数打开
+            cursor.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+
+    total_time = time.time() - start_time
+    print("构建完成，总计轨迹点数：", count, "，行程数：", trip_count)
+    print(f"导入耗时 {load_time:.1f}s，索引耗时 {total_time - load_time:.1f}s，"
+          f"总耗时 {total_time:.1f}s，吞吐 {count / max(total_time, 1e-9):.0f} 点/秒")
 
 if __name__ == "__main__":
-    build_database()
+    parser = argparse.ArgumentParser(description="构建轨迹数据库")
+    parser.add_argument("--safe", action="store_true", help="使用默认日志与同步设置导入（较慢）")
+    parser.add_argument("--workers", type=int, default=None, help="解析文件的进程数")
+    args = parser.parse_args()
+    build_database(fast=not args.safe, workers=args.workers)
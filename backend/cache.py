@@ -0,0 +1,181 @@
+"""
+查询结果缓存模块
+
+按规范化后的请求参数缓存各分析接口的响应：内存中按总字节数做 LRU 淘汰并设置过期时间，
+被淘汰的结果可选写入磁盘目录，数据集版本变化时整体失效；提供命中率等统计。
+"""
+
+import os
+import time
+import pickle
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 内存中缓存结果的总字节数上限
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+# 磁盘溢出目录的总字节数上限
+CACHE_SPILL_MAX_BYTES = 1024 * 1024 * 1024
+# 缓存结果的有效期（秒）
+CACHE_TTL = 3600
+
+
+class ResultCache:
+    """
+    LRU + TTL 结果缓存
+    Attributes:
+        max_bytes: 内存缓存字节数上限
+        ttl: 有效期（秒）
+        spill_dir: 磁盘溢出目录，None 表示不写磁盘
+        version: 当前缓存内容对应的数据集版本
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL, spill_dir=None,
+                 spill_max_bytes=CACHE_SPILL_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.version = None
+        self._entries = OrderedDict()  # 键 -> (过期时间, 值, 字节数)
+        self._bytes = 0
+        self._spilled = OrderedDict()  # 文件名 -> 字节数，按写入先后排序
+        self._spilled_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(("hits", "disk_hits", "misses", "expired", "evictions", "spills",
+                                        "invalidations"), 0)
+        if spill_dir:
+            # 溢出文件不跨进程复用，启动时清空
+            shutil.rmtree(spill_dir, ignore_errors=True)
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def get(self, key, version):
+        """
+        读取缓存结果
+        Args:
+            key: 规范化后的请求键（可哈希且 repr 稳定）
+            version: 数据集版本，与缓存内容的版本不同时清空缓存
+        Returns:
+            缓存的值，未命中时返回None
+        """
+        now = time.time()
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None and self.spill_dir:
+                entry = self._load_spilled(key)
+                if entry is not None:
+                    self._counters["disk_hits"] += 1
+                    self._insert(key, entry)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            if entry[0] < now:
+                self._counters["expired"] += 1
+                self._counters["misses"] += 1
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[1]
+
+    def put(self, key, version, value, size):
+        """
+        写入缓存结果
+        Args:
+            key: 规范化后的请求键
+            version: 数据集版本
+            value: 结果（需可 pickle）
+            size: 结果占用的字节数，用于容量控制
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            if key in self._entries:
+                self._remove(key)
+            self._insert(key, (time.time() + self.ttl, value, size))
+
+    def clear(self):
+        """清空内存与磁盘中的全部结果"""
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        """返回命中统计与占用情况"""
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return dict(self._counters,
+                        hit_rate=round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+                        entries=len(self._entries),
+                        bytes=self._bytes,
+                        spilled_entries=len(self._spilled),
+                        spilled_bytes=self._spilled_bytes,
+                        version=self.version)
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self.version is not None:
+                self._counters["invalidations"] += 1
+            self._clear()
+            self.version = version
+
+    def _clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        if self.spill_dir:
+            for name in self._spilled:
+                self._unlink(name)
+        self._spilled.clear()
+        self._spilled_bytes = 0
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._bytes += entry[2]
+        while self._bytes > self.max_bytes:
+            old_key, old_entry = self._entries.popitem(last=False)
+            self._bytes -= old_entry[2]
+            self._counters["evictions"] += 1
+            if self.spill_dir and old_entry[0] >= time.time():
+                self._spill(old_key, old_entry)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _filename(self, key):
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+    def _spill(self, key, entry):
+        name = self._filename(key)
+        with open(os.path.join(self.spill_dir, name), "wb") as f:
+            pickle.dump((key, entry), f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._spilled[name] = entry[2]
+        self._spilled_bytes += entry[2]
+        self._counters["spills"] += 1
+        while self._spilled_bytes > self.spill_max_bytes:
+            old_name, size = self._spilled.popitem(last=False)
+            self._spilled_bytes -= size
+            self._unlink(old_name)
+
+    def _load_spilled(self, key):
+        name = self._filename(key)
+        if name not in self._spilled:
+            return None
+        self._spilled_bytes -= self._spilled.pop(name)
+        try:
+            with open(os.path.join(self.spill_dir, name), "rb") as f:
+                spilled_key, entry = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+        finally:
+            self._unlink(name)
+        return entry if spilled_key == key else None
+
+    def _unlink(self, name):
+        try:
+            os.remove(os.path.join(self.spill_dir, name))
+        except OSError:
+            pass
@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 def wgs84_to_gcj02(lng, lat):
     """
@@ -41,4 +42,102 @@ def wgs84_to_gcj02(lng, lat):
     mglat = lat + dlat
     mglng = lng + dlng
     
-    return mglng, mglat
\ No newline at end of file
+    return mglng, mglat
+
+def gcj02_to_wgs84(lng, lat, tolerance=1e-9, max_iter=20):
+    """
+    GCJ02(火星坐标系)转WGS84，通过迭代逼近 wgs84_to_gcj02 的逆
+    参数:
+        lng: GCJ02经度
+        lat: GCJ02纬度
+        tolerance: 收敛阈值（度）
+        max_iter: 最大迭代次数
+    返回:
+        [WGS84经度, WGS84纬度]
+    """
+    if not (73.66 < lng < 135.05 and 3.86 < lat < 53.55):
+        return lng, lat
+
+    wgs_lng, wgs_lat = lng, lat
+    for _ in range(max_iter):
+        gcj_lng, gcj_lat = wgs84_to_gcj02(wgs_lng, wgs_lat)
+        d_lng, d_lat = gcj_lng - lng, gcj_lat - lat
+        wgs_lng -= d_lng
+        wgs_lat -= d_lat
+        if abs(d_lng) < tolerance and abs(d_lat) < tolerance:
+            break
+    return wgs_lng, wgs_lat
+
+
+def _transform_lat_array(x, y):
+    ret = -100.0 + 2.0 * x + 3.0 * y + 0.2 * y * y + 0.1 * x * y + 0.2 * np.sqrt(np.abs(x))
+    ret += (20.0 * np.sin(6.0 * x * np.pi) + 20.0 * np.sin(2.0 * x * np.pi)) * 2.0 / 3.0
+    ret += (20.0 * np.sin(y * np.pi) + 40.0 * np.sin(y / 3.0 * np.pi)) * 2.0 / 3.0
+    ret += (160.0 * np.sin(y / 12.0 * np.pi) + 320 * np.sin(y * np.pi / 30.0)) * 2.0 / 3.0
+    return ret
+
+
+def _transform_lng_array(x, y):
+    ret = 300.0 + x + 2.0 * y + 0.1 * x * x + 0.1 * x * y + 0.1 * np.sqrt(np.abs(x))
+    ret += (20.0 * np.sin(6.0 * x * np.pi) + 20.0 * np.sin(2.0 * x * np.pi)) * 2.0 / 3.0
+    ret += (20.0 * np.sin(x * np.pi) + 40.0 * np.sin(x / 3.0 * np.pi)) * 2.0 / 3.0
+    ret += (150.0 * np.sin(x / 12.0 * np.pi) + 300.0 * np.sin(x / 30.0 * np.pi)) * 2.0 / 3.0
+    return ret
+
+
+def in_china_array(lng, lat):
+    """返回坐标是否在国内的布尔掩码（国外坐标不做偏移）"""
+    return (73.66 < lng) & (lng < 135.05) & (3.86 < lat) & (lat < 53.55)
+
+
+def wgs84_to_gcj02_array(lng, lat):
+    """
+    WGS84转GCJ02的向量化版本
+    参数:
+        lng: WGS84经度数组
+        lat: WGS84纬度数组
+    返回:
+        (GCJ02经度数组, GCJ02纬度数组)，float64
+    """
+    lng = np.asarray(lng, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+
+    a = 6378245.0
+    ee = 0.00669342162296594323
+
+    dlat = _transform_lat_array(lng - 105.0, lat - 35.0)
+    dlng = _transform_lng_array(lng - 105.0, lat - 35.0)
+    radlat = lat / 180.0 * np.pi
+    magic = np.sin(radlat)
+    magic = 1 - ee * magic * magic
+    sqrtmagic = np.sqrt(magic)
+    dlat = (dlat * 180.0) / ((a * (1 - ee)) / (magic * sqrtmagic) * np.pi)
+    dlng = (dlng * 180.0) / (a / sqrtmagic * np.cos(radlat) * np.pi)
+
+    in_china = in_china_array(lng, lat)
+    return np.where(in_china, lng + dlng, lng), np.where(in_china, lat + dlat, lat)
+
+
+def gcj02_to_wgs84_array(lng, lat, tolerance=1e-9, max_iter=20):
+    """
+    GCJ02转WGS84的向量化版本（迭代逼近）
+    参数:
+        lng: GCJ02经度数组
+        lat: GCJ02纬度数组
+        tolerance: 收敛阈值（度）
+        max_iter: 最大迭代次数
+    返回:
+        (WGS84经度数组, WGS84纬度数组)，float64
+    """
+    lng = np.asarray(lng, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+
+    wgs_lng, wgs_lat = lng.copy(), lat.copy()
+    for _ in range(max_iter):
+        gcj_lng, gcj_lat = wgs84_to_gcj02_array(wgs_lng, wgs_lat)
+        d_lng, d_lat = gcj_lng - lng, gcj_lat - lat
+        wgs_lng -= d_lng
+        wgs_lat -= d_lat
+        if not len(lng) or max(np.abs(d_lng).max(), np.abs(d_lat).max()) < tolerance:
+            break
+    return wgs_lng, wgs_lat
@@ -0,0 +1,110 @@
+"""
+频繁项近似统计模块
+
+Count-Min Sketch 负责全部项的近似计数，另外维护一个容量有限的候选表保存估计值最高的项及其附加数据，
+内存占用只与 sketch 尺寸和候选表容量有关，与输入规模无关。
+"""
+
+import numpy as np
+
+# 64位乘法散列常数（黄金分割）
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class CountMinTopK:
+    """
+    Count-Min Sketch + 候选表的 Top-K 频繁项统计
+    Attributes:
+        capacity: 候选表保留的项数
+        table: (depth, width) 计数矩阵
+        candidates: {项: 附加数据}
+    """
+
+    def __init__(self, capacity, width_bits=20, depth=4, seed=2008):
+        self.capacity = capacity
+        self.width_bits = width_bits
+        self.table = np.zeros((depth, 1 << width_bits), dtype=np.int32)
+        self.salts = np.random.default_rng(seed).integers(1, 2 ** 63, size=depth, dtype=np.uint64)
+        self.candidates = {}
+        self.threshold = 0
+
+    def _indexes(self, items):
+        shift = np.uint64(64 - self.width_bits)
+        return [((items ^ salt) * _HASH_MULTIPLIER) >> shift for salt in self.salts]
+
+    def estimate(self, items):
+        """返回各项的估计计数（不小于真实计数）"""
+        items = np.asarray(items, dtype=np.uint64)
+        if not len(items):
+            return np.zeros(0, dtype=np.int32)
+        return np.min([row[idx] for row, idx in zip(self.table, self._indexes(items))], axis=0)
+
+    def add(self, items):
+        """
+        计入一批项
+        Args:
+            items: uint64 项数组（可重复）
+        Returns:
+            (new_items, first_index): 尚未进入候选表、且估计值超过当前门槛的项及其在批次中首次出现的位置，
+            调用方通过 track() 为其登记附加数据
+        """
+        items = np.asarray(items, dtype=np.uint64)
+        if not len(items):
+            return items, np.zeros(0, dtype=np.int64)
+        width = self.table.shape[1]
+        for row, idx in zip(self.table, self._indexes(items)):
+            row += np.bincount(idx.astype(np.int64), minlength=width).astype(np.int32)
+
+        unique, first_index = np.unique(items, return_index=True)
+        estimates = self.estimate(unique)
+        qualified = estimates > self.threshold
+        if self.candidates:
+            tracked = np.fromiter(self.candidates.keys(), dtype=np.uint64, count=len(self.candidates))
+            qualified &= ~np.isin(unique, tracked)
+        qualified = np.flatnonzero(qualified)
+        # 同一批次中只有估计值最高的 capacity 个新项可能留在候选表中
+        if len(qualified) > self.capacity:
+            qualified = qualified[np.argsort(-estimates[qualified], kind='stable')[:self.capacity]]
+        return unique[qualified], first_index[qualified]
+
+    def track(self, item, payload):
+        """登记候选项，候选表超过两倍容量时淘汰估计值最低的项"""
+        self.candidates[int(item)] = payload
+        if len(self.candidates) > 2 * self.capacity:
+            self._prune()
+
+    def merge(self, other):
+        """
+        合并另一份统计（如各进程分别统计的部分数据）：计数矩阵相加，候选表取并集，同一项保留本统计的附加数据
+        Args:
+            other: 尺寸与种子相同的 CountMinTopK
+        Raises:
+            ValueError: 两份统计的尺寸或散列种子不同
+        """
+        if self.table.shape != other.table.shape or not np.array_equal(self.salts, other.salts):
+            raise ValueError("只能合并尺寸与种子相同的统计")
+        self.table += other.table
+        for item, payload in other.candidates.items():
+            self.candidates.setdefault(item, payload)
+        self.threshold = max(self.threshold, other.threshold)
+        if len(self.candidates) > 2 * self.capacity:
+            self._prune()
+
+    def _prune(self):
+        keys = np.fromiter(self.candidates.keys(), dtype=np.uint64, count=len(self.candidates))
+        estimates = self.estimate(keys)
+        keep = np.argsort(-estimates, kind='stable')[:self.capacity]
+        self.threshold = int(estimates[keep[-1]])
+        self.candidates = {int(keys[i]): self.candidates[int(keys[i])] for i in keep.tolist()}
+
+    def items(self):
+        """
+        Returns:
+            list: 按估计计数降序的 [(项, 估计计数, 附加数据)]
+        """
+        if not self.candidates:
+            return []
+        keys = np.fromiter(self.candidates.keys(), dtype=np.uint64, count=len(self.candidates))
+        estimates = self.estimate(keys)
+        order = np.argsort(-estimates, kind='stable')[:self.capacity]
+        return [(int(keys[i]), int(estimates[i]), self.candidates[int(keys[i])]) for i in order.tolist()]
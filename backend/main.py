@@ -1,53 +1,169 @@
-from flask import Flask
-from F1 import get_trail_lists,get_trails_post
+import os
+import json
+from functools import wraps
+from flask import Flask, request, jsonify
+from F1 import get_trail_lists, get_trails_post, load_trail_lod
 from F3 import query_region
-from F4 import get_optimized_heatmap
-from F56 import analyze_flow
+from F4 import get_optimized_heatmap, get_heatmap_level
+from F56 import analyze_flow, load_transitions
 from F7 import frequent_paths
 from F8 import frequent_paths_ab
 from F9 import analyze_shortest_path
+from build_trajectory_db import DB_PATH
+from cache import ResultCache
+from service import get_pool
+from region_index import load_region_index
+from taxi_catalog import load_catalog
+from trajectory_store import DATA_DIR, open_store
 
 app = Flask(__name__)
 
+# 查询结果缓存，内存中淘汰的结果写入 result_cache 目录
+RESULT_CACHE = ResultCache(spill_dir="result_cache")
+# 规范化参数时坐标保留的小数位数（约1米）
+CACHE_DIGITS = 5
+# 坐标参数（[经度, 纬度] 或 "min_lng,max_lng,min_lat,max_lat"），取整到 CACHE_DIGITS 位
+COORD_PARAMS = {"ltPoint", "rbPoint", "area1", "area2", "areaA", "areaB", "viewport"}
+# 数值参数（可为逗号分隔的数字串），只统一为数值、不取整
+NUMERIC_PARAMS = {"grid_width", "tolerance", "toleranceMeters", "zoom", "hour", "minCount", "topN",
+                  "page", "pageSize", "k", "minDistance", "weekdays"}
+
+def normalize_param(value, digits=None):
+    """将数值参数规范化为可哈希的键：数字串转为数值，逗号分隔的数字串拆为元组，digits 不为None时取整"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize_param(item, digits)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize_param(item, digits) for item in value)
+    if isinstance(value, str):
+        try:
+            numbers = tuple(float(item) for item in value.split(','))
+        except ValueError:
+            return value
+        return normalize_param(numbers if len(numbers) > 1 else numbers[0], digits)
+    if isinstance(value, float) and digits is not None:
+        return round(value, digits)
+    return value
+
+def normalize_params(params):
+    """按参数名规范化请求参数：坐标取整，其余数值参数统一类型，关键字、车辆ID等其它参数原样保留"""
+    items = []
+    for key, value in params.items():
+        if key in COORD_PARAMS:
+            value = normalize_param(value, CACHE_DIGITS)
+        elif key in NUMERIC_PARAMS:
+            value = normalize_param(value)
+        elif isinstance(value, (list, dict)):
+            value = json.dumps(value, sort_keys=True)
+        items.append((key, value))
+    return tuple(sorted(items))
+
+def dataset_version():
+    """
+    数据集版本：列式存储的源数据签名与轨迹数据库的修改时间
+    存储不存在或已过期时签名为None，只按数据库修改时间区分版本，
+    只读数据库的接口（F8）照常缓存，依赖存储的接口自行返回错误
+    """
+    db_mtime = os.stat(DB_PATH).st_mtime_ns if os.path.exists(DB_PATH) else None
+    try:
+        store_source = json.dumps(open_store().meta["source"], sort_keys=True)
+    except FileNotFoundError:
+        store_source = None
+    return store_source, db_mtime
+
+def cached(defaults=None, skip=None):
+    """
+    按规范化的请求参数（查询串与JSON请求体，缺省值补齐）缓存接口的成功响应
+    Args:
+        defaults: 参数缺省值，与显式传入缺省值的请求共用缓存
+        skip: 返回True时不使用缓存（如随机抽样）
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper():
+            params = dict(defaults or {})
+            params.update(request.args.to_dict())
+            body = request.get_json(force=True, silent=True)
+            if isinstance(body, dict):
+                params.update(body)
+            if skip is not None and skip(params):
+                return handler()
+
+            # Accept 头决定响应格式（JSON / NDJSON 等），一并计入缓存键
+            key = (request.path, request.headers.get("Accept", ""), normalize_params(params))
+            version = dataset_version()
+            hit = RESULT_CACHE.get(key, version)
+            if hit is not None:
+                data, status, mimetype = hit
+                return app.response_class(data, status=status, mimetype=mimetype)
+
+            response = app.make_response(handler())
+            if response.status_code == 200 and not response.is_streamed:
+                data = response.get_data()
+                RESULT_CACHE.put(key, version, (data, response.status_code, response.mimetype), len(data))
+            return response
+        return wrapper
+    return decorator
+
 # F1
 @app.route('/trailLists', methods=['GET'])
+@cached({"keyword": ""})
 def new_get_trail_lists():
     return get_trail_lists()
 
 @app.route('/trails/data', methods=['POST'])
+@cached({"taxi_ids": "all", "simplify": False, "tolerance": 0.0001}, skip=lambda params: params.get("sampleCount"))
 def new_get_trails_post():
     return get_trails_post()
 
 # F3
 @app.route('/query_region', methods=['POST'])
+@cached({"ltPoint": [116.0, 40.0], "rbPoint": [117.0, 39.0], "countOnly": False})
 def new_query_region():
     return query_region()
 
 
 # F4
 @app.route('/heatmap', methods=['GET'])
+@cached({"grid_width": 0.01, "folder_path": DATA_DIR, "format": "rows", "minCount": 1})
 def new_get_optimized_heatmap():
     return get_optimized_heatmap()
 
 # F56
 @app.route('/flow_analysis', methods=['GET'])
+@cached({"folder_path": DATA_DIR, "mode": "index"})
 def new_analyze_flow():
     return analyze_flow()
 
 # F7
 @app.route('/frequent_paths', methods=['POST'])
+@cached({"minDistance": 1000, "k": 5})
 def new_frequent_paths():
     return frequent_paths()
 
 # F8
 @app.route('/frequent_paths_ab', methods=['POST'])
+@cached({"k": 5})
 def new_frequent_paths_ab():
     return frequent_paths_ab()
 
 # F9
 @app.route('/optimized_path', methods=['GET'])
+@cached({"folder_path": DATA_DIR})
 def new_analyze_shortest_path():
     return analyze_shortest_path()
 
+# 缓存统计
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(RESULT_CACHE.stats())
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # 启动时创建常驻进程池，并预先加载（必要时构建）存储、出租车目录、区域计数索引、热力图立方体、流量转移表与轨迹LOD金字塔
+    get_pool()
+    load_catalog(open_store(build=True))
+    load_region_index(open_store())
+    get_heatmap_level(open_store(), 0.01)
+    load_transitions(open_store())
+    load_trail_lod(open_store())
+    # 调试模式的重载器会再启动一个服务进程（及其进程池），这里关闭调试、以多线程处理并发请求
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""
+区域计数索引模块
+
+F3 只需要数量（countOnly）时，不再取出区域内的全部轨迹点，而是：
+- 按 (小时, 经度网格, 纬度网格) 统计点数并做三维前缀和（summed-area table），
+  完全位于矩形内部的网格、完全位于时间范围内的小时，点数由8次查表得到；
+- 每辆车每小时的轨迹片段（点区间与外接矩形）按小时排序保存，矩形边界网格与首尾不完整小时内的点，
+  只读取与之相交的片段逐点精确判断；去重车辆数也由这些片段精确得到。
+索引保存在列式存储目录内，每个进程只加载一次。
+"""
+
+import os
+import json
+import math
+import threading
+import numpy as np
+from service import map_partitions
+from trajectory_store import BEIJING_BOUNDS, COORD_SCALE, attach_store
+
+# 前缀和网格大小（度，约1公里）与时间桶宽度（秒）
+REGION_GRID_SIZE = 0.01
+REGION_BUCKET_SECONDS = 3600
+REGION_COLS = math.ceil(round((BEIJING_BOUNDS['max_lng'] - BEIJING_BOUNDS['min_lng']) / REGION_GRID_SIZE, 6))
+REGION_ROWS = math.ceil(round((BEIJING_BOUNDS['max_lat'] - BEIJING_BOUNDS['min_lat']) / REGION_GRID_SIZE, 6))
+
+REGION_SAT_FILE = "region_sat.npy"
+REGION_SEGMENTS_FILE = "region_segments.npz"
+REGION_META_FILE = "region_index.json"
+# 轨迹片段的各列：时间桶、车辆ID、点区间 [start, end)、外接矩形（GCJ02定点数）
+SEGMENT_FIELDS = ("bucket", "taxi_id", "start", "end", "min_lng", "max_lng", "min_lat", "max_lat")
+# 查找候选车辆时区域的外扩（度）：存储坐标为1e-7定点数，外扩后不会漏掉数据库中恰在边界上的点
+REGION_CANDIDATE_MARGIN = 1e-6
+
+# 每个进程缓存已加载的索引
+_region_indexes = {}
+_region_lock = threading.Lock()
+
+
+def grid_cols(lngs):
+    """经度 -> 网格列号（可能超出 [0, REGION_COLS)）"""
+    return np.floor((lngs - BEIJING_BOUNDS['min_lng']) / REGION_GRID_SIZE).astype(np.int64)
+
+
+def grid_rows(lats):
+    """纬度 -> 网格行号（可能超出 [0, REGION_ROWS)）"""
+    return np.floor((lats - BEIJING_BOUNDS['min_lat']) / REGION_GRID_SIZE).astype(np.int64)
+
+
+def region_partition(args):
+    """
+    统计 [start, end) 区间内的轨迹片段与 (时间桶, 网格) 点数（在子进程中执行）
+    Returns:
+        (segments, keys, counts): 片段字段名 -> 数组；前缀和网格的展平下标（升序）及点数
+    """
+    store_dir, start, end, first_bucket = args
+    store = attach_store(store_dir)
+    epoch = np.asarray(store.epoch[start:end], dtype=np.int64)
+    lngs, lats = store.lng_gcj[start:end], store.lat_gcj[start:end]
+    taxi_ids = np.asarray(store.taxi_id[start:end])
+    buckets = epoch // REGION_BUCKET_SECONDS
+
+    # 同一辆车同一小时的点在存储中连续
+    starts = np.flatnonzero((np.diff(taxi_ids, prepend=-1) != 0) | (np.diff(buckets, prepend=-1) != 0))
+    segments = {"bucket": buckets[starts], "taxi_id": taxi_ids[starts].astype(np.int64),
+                "start": starts + start, "end": np.append(starts, len(epoch))[1:] + start}
+    for axis, column in (("lng", lngs), ("lat", lats)):
+        segments[f"min_{axis}"] = np.minimum.reduceat(column, starts)
+        segments[f"max_{axis}"] = np.maximum.reduceat(column, starts)
+
+    cols, rows = grid_cols(lngs / COORD_SCALE), grid_rows(lats / COORD_SCALE)
+    inside = (0 <= cols) & (cols < REGION_COLS) & (0 <= rows) & (rows < REGION_ROWS)
+    keys = ((buckets[inside] - first_bucket) * REGION_COLS + cols[inside]) * REGION_ROWS + rows[inside]
+    keys, counts = np.unique(keys, return_counts=True)
+    return segments, keys, counts
+
+
+def build_region_index(store):
+    """
+    在常驻进程池中统计，主进程汇总为三维前缀和，并将轨迹片段按 (时间桶, 车辆) 排序
+    Returns:
+        dict: sat（(小时数+1, 列数+1, 行数+1) 前缀和，首行首列为0）、first_bucket、segments
+    """
+    first_bucket = int(np.min(store.epoch)) // REGION_BUCKET_SECONDS if len(store) else 0
+    bucket_count = int(np.max(store.epoch)) // REGION_BUCKET_SECONDS - first_bucket + 1 if len(store) else 1
+    # 空存储没有区间，在本进程中统计一个空区间，得到结构相同的空索引
+    parts = map_partitions(region_partition, store, first_bucket) or \
+        [region_partition((store.path, 0, 0, first_bucket))]
+
+    counts = np.zeros(bucket_count * REGION_COLS * REGION_ROWS, dtype=np.int64)
+    np.add.at(counts, np.concatenate([part[1] for part in parts]), np.concatenate([part[2] for part in parts]))
+    sat = np.zeros((bucket_count + 1, REGION_COLS + 1, REGION_ROWS + 1),
+                   dtype=np.int32 if len(store) < 2 ** 31 else np.int64)
+    sat[1:, 1:, 1:] = counts.reshape(bucket_count, REGION_COLS, REGION_ROWS).cumsum(0).cumsum(1).cumsum(2)
+
+    segments = {name: np.concatenate([part[0][name] for part in parts]) for name in SEGMENT_FIELDS}
+    order = np.lexsort((segments["taxi_id"], segments["bucket"]))
+    return {"sat": sat, "first_bucket": first_bucket,
+            "segments": {name: column[order] for name, column in segments.items()}}
+
+
+def load_region_index(store):
+    """
+    读取区域计数索引，不存在或与存储不一致时重新构建并落盘（每个进程只加载一次，前缀和以 memmap 读取）
+    """
+    with _region_lock:
+        if store.path in _region_indexes:
+            return _region_indexes[store.path]
+
+        sat_file = os.path.join(store.path, REGION_SAT_FILE)
+        segments_file = os.path.join(store.path, REGION_SEGMENTS_FILE)
+        meta_file = os.path.join(store.path, REGION_META_FILE)
+        expected = {"grid_size": REGION_GRID_SIZE, "bucket_seconds": REGION_BUCKET_SECONDS,
+                    "bounds": BEIJING_BOUNDS, "source": store.meta["source"]}
+        index = None
+        if all(os.path.exists(path) for path in (sat_file, segments_file, meta_file)):
+            with open(meta_file) as f:
+                meta = json.load(f)
+            first_bucket = meta.pop("first_bucket", None)
+            if first_bucket is not None and meta == expected:
+                with np.load(segments_file) as data:
+                    segments = {name: data[name] for name in SEGMENT_FIELDS}
+                index = {"sat": np.load(sat_file, mmap_mode='r'), "first_bucket": first_bucket, "segments": segments}
+        if index is None:
+            index = build_region_index(store)
+            np.save(sat_file, index["sat"])
+            np.savez(segments_file, **index["segments"])
+            with open(meta_file, 'w') as f:
+                json.dump(dict(expected, first_bucket=index["first_bucket"]), f)
+        _region_indexes[store.path] = index
+        return index
+
+
+def box_sum(sat, b0, b1, c0, c1, r0, r1):
+    """前缀和中 [b0, b1) × [c0, c1) × [r0, r1) 的总和"""
+    return int(sat[b1, c1, r1]) - int(sat[b0, c1, r1]) - int(sat[b1, c0, r1]) - int(sat[b1, c1, r0]) \
+        + int(sat[b0, c0, r1]) + int(sat[b0, c1, r0]) + int(sat[b1, c0, r0]) - int(sat[b0, c0, r0])
+
+
+def window_segments(index, start_epoch, end_epoch):
+    """所在小时与 [start_epoch, end_epoch] 相交的轨迹片段（字段名 -> 数组）"""
+    segments = index["segments"]
+    lo = np.searchsorted(segments["bucket"], start_epoch // REGION_BUCKET_SECONDS, side='left')
+    hi = np.searchsorted(segments["bucket"], end_epoch // REGION_BUCKET_SECONDS, side='right')
+    return {name: column[lo:hi] for name, column in segments.items()}
+
+
+def region_candidates(index, region, margin=REGION_CANDIDATE_MARGIN):
+    """
+    可能在矩形与时间范围内出现的车辆，及每辆车相交片段覆盖的时间范围
+    Args:
+        index: load_region_index 返回的索引
+        region: (min_lng, max_lng, min_lat, max_lat, start_epoch, end_epoch)，GCJ02坐标
+        margin: 区域外扩（度）
+    Returns:
+        (taxi_ids, start_epochs, end_epochs): 车辆ID（升序）与各车需要读取的时间范围（闭区间）
+    """
+    min_lng, max_lng, min_lat, max_lat, start_epoch, end_epoch = region
+    seg = window_segments(index, start_epoch, end_epoch)
+    touches = (seg["min_lng"] / COORD_SCALE <= max_lng + margin) & (seg["max_lng"] / COORD_SCALE >= min_lng - margin) & \
+        (seg["min_lat"] / COORD_SCALE <= max_lat + margin) & (seg["max_lat"] / COORD_SCALE >= min_lat - margin)
+    taxi_ids, inverse = np.unique(seg["taxi_id"][touches], return_inverse=True)
+    buckets = seg["bucket"][touches]
+    first = np.full(len(taxi_ids), np.iinfo(np.int64).max, dtype=np.int64)
+    last = np.full(len(taxi_ids), np.iinfo(np.int64).min, dtype=np.int64)
+    np.minimum.at(first, inverse, buckets)
+    np.maximum.at(last, inverse, buckets)
+    return (taxi_ids, np.maximum(first * REGION_BUCKET_SECONDS, start_epoch),
+            np.minimum((last + 1) * REGION_BUCKET_SECONDS - 1, end_epoch))
+
+
+def count_region(store, index, region):
+    """
+    统计矩形与时间范围内的轨迹点数与车辆数（与逐点判断的结果一致）
+    Args:
+        store: 列式轨迹存储
+        index: load_region_index 返回的索引
+        region: (min_lng, max_lng, min_lat, max_lat, start_epoch, end_epoch)，GCJ02坐标，边界与时间均为闭区间
+    Returns:
+        (points, taxis): 点数与去重车辆数
+    """
+    min_lng, max_lng, min_lat, max_lat, start_epoch, end_epoch = region
+    sat, first_bucket = index["sat"], index["first_bucket"]
+
+    # 完全位于时间范围内的小时、完全位于矩形内部的网格（列号随经度单调，落在首末列之间的点必在矩形内）
+    full_lo = -(-start_epoch // REGION_BUCKET_SECONDS)
+    full_hi = (end_epoch + 1) // REGION_BUCKET_SECONDS - 1
+    full_lo, full_hi = max(full_lo, first_bucket), min(full_hi, first_bucket + sat.shape[0] - 2)
+    c_lo, c_hi = max(int(grid_cols(min_lng)) + 1, 0), min(int(grid_cols(max_lng)) - 1, REGION_COLS - 1)
+    r_lo, r_hi = max(int(grid_rows(min_lat)) + 1, 0), min(int(grid_rows(max_lat)) - 1, REGION_ROWS - 1)
+    has_interior = full_lo <= full_hi and c_lo <= c_hi and r_lo <= r_hi
+    points = box_sum(sat, full_lo - first_bucket, full_hi - first_bucket + 1,
+                     c_lo, c_hi + 1, r_lo, r_hi + 1) if has_interior else 0
+
+    # 时间范围内的片段
+    seg = window_segments(index, start_epoch, end_epoch)
+    seg_min_lng, seg_max_lng = seg["min_lng"] / COORD_SCALE, seg["max_lng"] / COORD_SCALE
+    seg_min_lat, seg_max_lat = seg["min_lat"] / COORD_SCALE, seg["max_lat"] / COORD_SCALE
+    touches = (seg_min_lng <= max_lng) & (seg_max_lng >= min_lng) & (seg_min_lat <= max_lat) & (seg_max_lat >= min_lat)
+    # 全部点都已计入前缀和的片段
+    counted = has_interior & (full_lo <= seg["bucket"]) & (seg["bucket"] <= full_hi) & \
+        (c_lo <= grid_cols(seg_min_lng)) & (grid_cols(seg_max_lng) <= c_hi) & \
+        (r_lo <= grid_rows(seg_min_lat)) & (grid_rows(seg_max_lat) <= r_hi)
+    exact = np.flatnonzero(touches & ~counted)
+
+    # 其余相交片段逐点判断
+    starts = seg["start"][exact]
+    lengths = seg["end"][exact] - starts
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    epoch = np.asarray(store.epoch[positions], dtype=np.int64)
+    lngs, lats = store.lng_gcj[positions] / COORD_SCALE, store.lat_gcj[positions] / COORD_SCALE
+    matched = (min_lng <= lngs) & (lngs <= max_lng) & (min_lat <= lats) & (lats <= max_lat) & \
+        (start_epoch <= epoch) & (epoch <= end_epoch)
+    in_sat = (c_lo <= grid_cols(lngs)) & (grid_cols(lngs) <= c_hi) & \
+        (r_lo <= grid_rows(lats)) & (grid_rows(lats) <= r_hi) & \
+        (full_lo * REGION_BUCKET_SECONDS <= epoch) & (epoch < (full_hi + 1) * REGION_BUCKET_SECONDS)
+    points += int((matched & ~(in_sat & has_interior)).sum())
+
+    taxis = np.union1d(seg["taxi_id"][counted], store.taxi_id[positions[matched]])
+    return points, len(taxis)
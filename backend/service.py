@@ -0,0 +1,47 @@
+"""
+后台服务层
+
+应用启动时创建常驻进程池，各分析接口把按出租车划分的区间任务提交给它，
+避免每次请求重新创建进程、导入模块和打开存储；进程总数不随并发请求增长。
+工作进程通过 trajectory_store.attach_store 复用已打开的 memmap 列，数据由操作系统页缓存在进程间共享。
+"""
+
+import atexit
+import threading
+from multiprocessing import Pool, cpu_count
+
+# 常驻进程池大小
+POOL_WORKERS = min(cpu_count(), 4)
+# 每个工作进程分到的区间数，区间越多负载越均衡
+PARTITIONS_PER_WORKER = 8
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """返回常驻进程池，首次调用时创建"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = Pool(POOL_WORKERS)
+            atexit.register(_pool.terminate)
+        return _pool
+
+
+def map_partitions(func, store, *args, parts=None, taxis=None):
+    """
+    将存储按出租车边界划分为区间，在常驻进程池中执行 func((store.path, start, end, *args))
+    Args:
+        func: 模块级任务函数
+        store: 列式轨迹存储
+        args: 附加参数
+        parts: 区间数，默认为进程数 × PARTITIONS_PER_WORKER
+        taxis: 可选，只处理这些车辆（车辆下标数组，见 TrajectoryStore.partitions）
+    Returns:
+        list: 按区间顺序排列的各任务结果
+    """
+    parts = parts or POOL_WORKERS * PARTITIONS_PER_WORKER
+    tasks = [(store.path, start, end) + args for start, end in store.partitions(parts, taxis)]
+    # 只处理部分车辆时区间可能很多，按批分发以减少进程间通信
+    return get_pool().map(func, tasks, chunksize=max(len(tasks) // parts, 1))
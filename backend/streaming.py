@@ -0,0 +1,36 @@
+"""
+流式响应模块
+
+大结果集以 NDJSON（每行一个JSON对象）逐条输出：记录由生成器按需产生，首条记录产生后立即发送，
+服务端内存不随结果规模增长。
+"""
+
+import json
+from flask import Response, request
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def wants_ndjson(params):
+    """
+    判断是否使用流式响应
+    Args:
+        params: 请求参数（JSON请求体）
+    Returns:
+        bool: 请求体 stream 为真，或 Accept 头要求 NDJSON 时返回True
+    """
+    return bool(params.get("stream")) or NDJSON_MIMETYPE in request.accept_mimetypes.values()
+
+
+def ndjson_response(records):
+    """
+    将记录生成器包装为 NDJSON 流式响应
+    Args:
+        records: 逐条产生可JSON序列化对象的可迭代对象
+    Returns:
+        Response: 分块传输的流式响应
+    """
+    def generate():
+        for record in records:
+            yield json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n"
+    return Response(generate(), mimetype=NDJSON_MIMETYPE)
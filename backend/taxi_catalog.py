@@ -0,0 +1,166 @@
+"""
+出租车目录模块
+
+为列式存储中的每辆车记录点数、起止时间、外接矩形与在存储中的偏移，以及每辆车在一天中各小时的外接矩形，
+保存在列式存储目录内，每个进程只加载一次。目录同时提供车辆ID的前缀/子串检索（/trailLists 自动补全），
+以及按每小时的外接矩形快速排除不可能命中的车辆，扫描类接口只需处理剩余车辆。
+"""
+
+import os
+import json
+import bisect
+import threading
+import numpy as np
+from service import map_partitions
+from trajectory_store import COORD_SCALE, attach_store, hour_of_day
+
+CATALOG_FILE = "taxi_catalog.npz"
+CATALOG_META_FILE = "taxi_catalog.json"
+CATALOG_VERSION = 2
+
+# 目录的各列：车辆ID、在存储中的偏移与点数、起止时间（存储中的秒数）、外接矩形（GCJ02）
+CATALOG_FIELDS = ("taxi_id", "offset", "count", "start_epoch", "end_epoch",
+                  "min_lng", "max_lng", "min_lat", "max_lat")
+# 每车每小时（0-23，所有日期合并）的点数与外接矩形，形状为 (车辆数, 24)；没有点的小时为空矩形（min=inf, max=-inf）
+HOURLY_FIELDS = ("hour_count", "hour_min_lng", "hour_max_lng", "hour_min_lat", "hour_max_lat")
+
+# 检索结果默认每页条数
+SEARCH_PAGE_SIZE = 50
+
+# 每个进程缓存已加载的目录
+_catalogs = {}
+_catalog_lock = threading.Lock()
+
+
+class TaxiCatalog:
+    """
+    出租车目录
+    Attributes:
+        columns: 字段名 -> 数组，按车辆ID升序，与 store.taxis 一一对应
+        ids: 车辆ID字符串列表（与 columns 同序）
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.ids = [str(taxi_id) for taxi_id in columns["taxi_id"].tolist()]
+        # 子串索引：全部ID的全部后缀排序，子串查询即对后缀做前缀查询
+        suffixes = sorted((taxi_id[i:], row, i) for row, taxi_id in enumerate(self.ids) for i in range(len(taxi_id)))
+        self._suffixes = [suffix for suffix, _, _ in suffixes]
+        self._suffix_rows = np.array([row for _, row, _ in suffixes], dtype=np.int64)
+        self._suffix_starts = np.array([start for _, _, start in suffixes], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, keyword="", offset=0, limit=SEARCH_PAGE_SIZE):
+        """
+        按子串检索车辆ID
+        Args:
+            keyword: 关键字，为空时返回全部车辆
+            offset: 跳过的结果条数
+            limit: 最多返回的条数
+        Returns:
+            (total, ids): 匹配总数与本页的车辆ID；以关键字开头的ID排在前面，其余按ID升序
+        """
+        if not keyword:
+            return len(self.ids), self.ids[offset:offset + limit]
+        lo = bisect.bisect_left(self._suffixes, keyword)
+        hi = bisect.bisect_left(self._suffixes, keyword + "\U0010ffff")
+        rows = self._suffix_rows[lo:hi]
+        prefix = np.unique(rows[self._suffix_starts[lo:hi] == 0])
+        others = np.setdiff1d(rows, prefix)
+        order = np.concatenate([prefix, others])
+        return len(order), [self.ids[row] for row in order[offset:offset + limit].tolist()]
+
+    def hourly_candidates(self, areas):
+        """
+        在同一小时内的外接矩形与所有给定范围都相交的车辆
+        Args:
+            areas: [(min_lng, max_lng, min_lat, max_lat), ...]，GCJ02坐标
+        Returns:
+            np.ndarray: 可能命中的车辆行号（升序）
+        """
+        c = self.columns
+        mask = c["hour_count"] > 0
+        for min_lng, max_lng, min_lat, max_lat in areas:
+            mask &= (c["hour_min_lng"] <= max_lng) & (c["hour_max_lng"] >= min_lng) & \
+                    (c["hour_min_lat"] <= max_lat) & (c["hour_max_lat"] >= min_lat)
+        return np.flatnonzero(mask.any(axis=1))
+
+
+def catalog_partition(args):
+    """
+    汇总 [start, end) 区间内每辆车的目录字段（在子进程中执行）
+    Returns:
+        dict: 字段名 -> 本区间车辆的数组
+    """
+    store_dir, start, end = args
+    store = attach_store(store_dir)
+    lo, hi = np.searchsorted(store.offsets, [start, end])
+    bounds = store.offsets[lo:hi + 1] - start
+    starts, counts = bounds[:-1], np.diff(bounds)
+    epoch = np.asarray(store.epoch[start:end], dtype=np.int64)
+    lngs, lats = store.lng_gcj[start:end], store.lat_gcj[start:end]
+
+    columns = {"taxi_id": np.asarray(store.taxis[lo:hi], dtype=np.int64),
+               "offset": starts + start,
+               "count": counts,
+               # 存储中每辆车的点已按时间排序
+               "start_epoch": epoch[starts],
+               "end_epoch": epoch[bounds[1:] - 1]}
+    for axis, column in (("lng", lngs), ("lat", lats)):
+        columns[f"min_{axis}"] = np.minimum.reduceat(column, starts) / COORD_SCALE
+        columns[f"max_{axis}"] = np.maximum.reduceat(column, starts) / COORD_SCALE
+
+    # 按 (车辆, 小时) 分组汇总
+    keys = np.repeat(np.arange(len(counts)), counts) * 24 + hour_of_day(epoch)
+    size = len(counts) * 24
+    columns["hour_count"] = np.bincount(keys, minlength=size).reshape(-1, 24)
+    empty = columns["hour_count"] == 0
+    for axis, column in (("lng", lngs), ("lat", lats)):
+        low = np.full(size, np.iinfo(np.int32).max, dtype=np.int32)
+        high = np.full(size, np.iinfo(np.int32).min, dtype=np.int32)
+        np.minimum.at(low, keys, column)
+        np.maximum.at(high, keys, column)
+        columns[f"hour_min_{axis}"] = np.where(empty, np.inf, low.reshape(-1, 24) / COORD_SCALE)
+        columns[f"hour_max_{axis}"] = np.where(empty, -np.inf, high.reshape(-1, 24) / COORD_SCALE)
+    return columns
+
+
+def build_catalog(store):
+    """
+    在常驻进程池中逐区间汇总，各进程的结果在主进程中按区间顺序拼接一次
+    Returns:
+        dict: 字段名 -> 数组
+    """
+    # 空存储没有区间，在本进程中汇总一个空区间，得到结构相同的空目录
+    parts = map_partitions(catalog_partition, store) or [catalog_partition((store.path, 0, 0))]
+    return {name: np.concatenate([part[name] for part in parts]) for name in CATALOG_FIELDS + HOURLY_FIELDS}
+
+
+def load_catalog(store):
+    """
+    读取出租车目录，不存在或与存储不一致时重新构建并落盘（每个进程只加载一次）
+    Returns:
+        TaxiCatalog: 目录
+    """
+    with _catalog_lock:
+        if store.path in _catalogs:
+            return _catalogs[store.path]
+
+        catalog_file = os.path.join(store.path, CATALOG_FILE)
+        meta_file = os.path.join(store.path, CATALOG_META_FILE)
+        expected = {"version": CATALOG_VERSION, "source": store.meta["source"]}
+        columns = None
+        if os.path.exists(catalog_file) and os.path.exists(meta_file):
+            with open(meta_file) as f:
+                if json.load(f) == expected:
+                    with np.load(catalog_file) as data:
+                        columns = {name: data[name] for name in CATALOG_FIELDS + HOURLY_FIELDS}
+        if columns is None:
+            columns = build_catalog(store)
+            np.savez(catalog_file, **columns)
+            with open(meta_file, 'w') as f:
+                json.dump(expected, f)
+        _catalogs[store.path] = TaxiCatalog(columns)
+        return _catalogs[store.path]
@@ -0,0 +1,104 @@
+"""
+轨迹二进制编码模块
+
+F1 /trails/data 与 F3 /query_region 的可选二进制响应格式（Accept: application/x-trails），
+与 JSON 的 车辆/路径 结构一一对应，体积约为 JSON 的 1/3，且前端可直接用 Int32Array 解析。
+编码直接读取轨迹的列数组，逐条轨迹生成数据块并流式发送，不在服务端缓存全部轨迹。
+
+格式（小端 int32 序列，可整体映射为一个 Int32Array）：
+    [0:2]          魔数 "TRL2"、版本号
+    每条轨迹一块：
+        车辆ID、点数 n
+        n 个       纬度（定点数，1e-7度）
+        n 个       经度（定点数，1e-7度）
+        n 个       时间（Unix时间戳，秒）
+    结尾：         -1、轨迹数 T、总点数 N
+坐标与时间在每条轨迹内做差分编码：首点为绝对值，其余为与前一点的差值。
+"""
+
+import numpy as np
+from flask import Response, request
+
+TRAILS_MIMETYPE = "application/x-trails"
+TRAILS_MAGIC = b"TRL2"
+TRAILS_VERSION = 2
+# 结尾块的标记（代替车辆ID）
+TRAILS_END = -1
+# 坐标定点数比例：1e-7度（约1厘米）
+TRAILS_COORD_SCALE = 10_000_000
+
+
+def wants_binary():
+    """Accept 头要求二进制轨迹格式时返回True"""
+    return TRAILS_MIMETYPE in request.accept_mimetypes.values()
+
+
+def _delta(values):
+    """轨迹内差分：首点保留绝对值"""
+    return np.diff(values, prepend=0)
+
+
+def encode_trail(vendor, lats, lngs, timestamps):
+    """
+    编码一条轨迹
+    Args:
+        vendor: 车辆ID
+        lats, lngs: 纬度、经度数组（度）
+        timestamps: Unix时间戳数组（秒）
+    Returns:
+        bytes: 该轨迹的数据块
+    """
+    columns = [np.rint(np.asarray(lats, dtype=np.float64) * TRAILS_COORD_SCALE).astype(np.int64),
+               np.rint(np.asarray(lngs, dtype=np.float64) * TRAILS_COORD_SCALE).astype(np.int64),
+               np.rint(np.asarray(timestamps, dtype=np.float64)).astype(np.int64)]
+    return np.concatenate([[vendor, len(columns[0])]] + [_delta(column) for column in columns]).astype('<i4').tobytes()
+
+
+def iter_encoded_trails(trails):
+    """
+    逐块编码轨迹（用于流式响应）
+    Args:
+        trails: 可迭代的 (车辆ID, 纬度数组, 经度数组, 时间戳数组)
+    Yields:
+        bytes: 文件头、每条轨迹的数据块、结尾块
+    """
+    yield np.array([int.from_bytes(TRAILS_MAGIC, "little"), TRAILS_VERSION], dtype='<i4').tobytes()
+    trail_count = point_count = 0
+    for vendor, lats, lngs, timestamps in trails:
+        trail_count += 1
+        point_count += len(lats)
+        yield encode_trail(vendor, lats, lngs, timestamps)
+    yield np.array([TRAILS_END, trail_count, point_count], dtype='<i4').tobytes()
+
+
+def encode_trails(trails):
+    """编码全部轨迹（见 iter_encoded_trails）"""
+    return b"".join(iter_encoded_trails(trails))
+
+
+def decode_trails(data):
+    """
+    解码轨迹（encode_trails 的逆过程，坐标精度为 1e-7 度、时间精度为秒）
+    Returns:
+        list: [(车辆ID, [[纬度, 经度, 时间戳], ...]), ...]
+    """
+    words = np.frombuffer(data, dtype='<i4')
+    if words[:1].tobytes() != TRAILS_MAGIC or words[1] != TRAILS_VERSION:
+        raise ValueError("不是有效的二进制轨迹数据")
+    trails = []
+    position = 2
+    while words[position] != TRAILS_END:
+        vendor, count = int(words[position]), int(words[position + 1])
+        columns = np.cumsum(words[position + 2:position + 2 + 3 * count].reshape(3, count).astype(np.int64), axis=1)
+        trails.append((vendor, [list(point) for point in zip((columns[0] / TRAILS_COORD_SCALE).tolist(),
+                                                             (columns[1] / TRAILS_COORD_SCALE).tolist(),
+                                                             columns[2].astype(np.float64).tolist())]))
+        position += 2 + 3 * count
+    if (int(words[position + 1]), int(words[position + 2])) != (len(trails), sum(len(path) for _, path in trails)):
+        raise ValueError("二进制轨迹数据不完整")
+    return trails
+
+
+def binary_response(trails):
+    """将 (车辆ID, 纬度数组, 经度数组, 时间戳数组) 逐条编码为流式二进制轨迹响应"""
+    return Response(iter_encoded_trails(trails), mimetype=TRAILS_MIMETYPE)
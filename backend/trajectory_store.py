@@ -0,0 +1,432 @@
+"""
+轨迹列式存储模块
+
+将 taxi_log_2008_by_id/*.txt 原始日志一次性转换为紧凑的列式二进制文件，
+各功能模块通过 numpy.memmap 直接读取，不再在每次请求时逐行解析文本。
+
+存储目录位于数据目录旁（如 taxi_log_2008_by_id_store/），包含：
+- taxi_id.npy  int32  每个点所属的出租车ID
+- epoch.npy    int32  时间，按墙上时间（北京时间）计的秒数
+- lng.npy      int32  WGS84经度，定点数（× COORD_SCALE）
+- lat.npy      int32  WGS84纬度，定点数（× COORD_SCALE）
+- lng_gcj.npy  int32  GCJ02经度，定点数（导入时一次性转换）
+- lat_gcj.npy  int32  GCJ02纬度，定点数
+- taxis.npy    int32  出租车ID（升序）
+- offsets.npy  int64  每辆车在各列中的起始偏移，长度为车辆数+1
+- meta.json    格式版本、点数与源数据签名
+
+用法：
+    python trajectory_store.py [数据目录]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import datetime
+import threading
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from coordTransform_utils import wgs84_to_gcj02_array
+
+DATA_DIR = "taxi_log_2008_by_id"
+STORE_SUFFIX = "_store"
+# 接口可通过 folder_path 指定的数据目录
+ALLOWED_DATA_DIRS = (DATA_DIR,)
+STORE_VERSION = 2
+
+# 坐标定点数比例：1e-7度，可无损还原原始日志中的5位小数
+COORD_SCALE = 10_000_000
+
+# 北京边界坐标（GCJ02），热力图、流量转移表与区域计数索引的网格均以此为范围
+BEIJING_BOUNDS = {
+    'min_lng': 115.70,
+    'max_lng': 117.50,
+    'min_lat': 39.40,
+    'max_lat': 41.60
+}
+
+COLUMNS = ("taxi_id", "epoch", "lng", "lat", "lng_gcj", "lat_gcj")
+
+# 预聚合（热力图立方体、流量转移表）的时间桶宽度（秒），需整除一天；时间窗口按桶对齐
+TIME_BUCKET_SECONDS = 900
+
+# 已打开的存储（按数据目录缓存，每个进程只校验一次源数据；工作进程按存储目录缓存）
+_open_stores = {}
+_attached_stores = {}
+_open_lock = threading.Lock()
+
+
+def store_path(data_dir=DATA_DIR):
+    """返回数据目录对应的列式存储目录"""
+    return os.path.normpath(data_dir) + STORE_SUFFIX
+
+
+def resolve_data_dir(folder_path=None):
+    """
+    将请求中的 folder_path 解析为允许的数据目录
+    Raises:
+        ValueError: 不在 ALLOWED_DATA_DIRS 中
+    """
+    if not folder_path:
+        return DATA_DIR
+    for data_dir in ALLOWED_DATA_DIRS:
+        if os.path.abspath(folder_path) == os.path.abspath(data_dir):
+            return data_dir
+    raise ValueError(f"不允许的数据目录: {folder_path}")
+
+
+def parse_time(time_str):
+    """将 "YYYY-MM-DD HH:MM:SS" 解析为存储使用的秒数"""
+    dt = datetime.datetime.strptime(time_str, "%Y-%m-%d %H:%M:%S")
+    return int((dt - datetime.datetime(1970, 1, 1)).total_seconds())
+
+
+def format_time(epoch):
+    """将存储使用的秒数格式化为 "YYYY-MM-DD HH:MM:SS"（parse_time 的逆运算）"""
+    return (datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=int(epoch))).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def to_timestamp(epoch):
+    """
+    将存储中的秒数转换为Unix时间戳，
+    与 datetime.strptime(...).timestamp() 的结果一致（按服务器本地时区解释）
+    """
+    return np.asarray(epoch, dtype=np.float64) + time.timezone
+
+
+def hour_of_day(epoch):
+    """返回每个时间所在的小时（0-23）"""
+    return (np.asarray(epoch, dtype=np.int64) // 3600) % 24
+
+
+def day_of_week(epoch):
+    """返回每个时间是星期几（0为星期一，6为星期日）"""
+    # 1970-01-01 是星期四
+    return (np.asarray(epoch, dtype=np.int64) // 86400 + 3) % 7
+
+
+def time_bucket(epoch):
+    """返回每个时间所在的时间桶编号（自1970-01-01起第几个 TIME_BUCKET_SECONDS）"""
+    return np.asarray(epoch, dtype=np.int64) // TIME_BUCKET_SECONDS
+
+
+def bucket_hours(buckets):
+    """返回每个时间桶所在的小时（0-23）"""
+    return hour_of_day(np.asarray(buckets, dtype=np.int64) * TIME_BUCKET_SECONDS)
+
+
+class TimeWindow:
+    """
+    时间窗口：起止时间与星期几过滤，按时间桶对齐（与 [start_epoch, end_epoch] 有交集的桶整体计入）
+    Attributes:
+        start_epoch, end_epoch: 起止时间（存储中的秒数），None 表示不限
+        weekdays: 星期几列表（0为星期一），None 表示不限
+    """
+    __slots__ = ("start_epoch", "end_epoch", "weekdays")
+
+    def __init__(self, start_epoch=None, end_epoch=None, weekdays=None):
+        self.start_epoch = start_epoch
+        self.end_epoch = end_epoch
+        self.weekdays = weekdays
+
+    def bucket_mask(self, buckets):
+        """返回落在窗口内的时间桶"""
+        buckets = np.asarray(buckets, dtype=np.int64)
+        mask = np.ones(len(buckets), dtype=bool)
+        if self.start_epoch is not None:
+            mask &= buckets >= self.start_epoch // TIME_BUCKET_SECONDS
+        if self.end_epoch is not None:
+            mask &= buckets <= self.end_epoch // TIME_BUCKET_SECONDS
+        if self.weekdays is not None:
+            mask &= np.isin(day_of_week(buckets * TIME_BUCKET_SECONDS), self.weekdays)
+        return mask
+
+    def point_mask(self, epoch):
+        """返回所在时间桶落在窗口内的点"""
+        return self.bucket_mask(time_bucket(epoch))
+
+
+def parse_time_window(params):
+    """
+    从请求参数解析时间窗口
+    Args:
+        params: 含可选 startTime、endTime（"YYYY-MM-DD HH:MM:SS"）与 weekdays（"0,5,6" 或列表，0为星期一）
+    Returns:
+        TimeWindow 或 None: 未指定任何条件时返回None
+    """
+    start, end, weekdays = params.get("startTime"), params.get("endTime"), params.get("weekdays")
+    if not start and not end and weekdays in (None, ""):
+        return None
+    if isinstance(weekdays, str):
+        weekdays = [int(day) for day in weekdays.split(",") if day.strip()]
+    return TimeWindow(parse_time(start) if start else None, parse_time(end) if end else None,
+                      [int(day) for day in weekdays] if weekdays is not None else None)
+
+
+def source_signature(data_dir):
+    """计算源数据签名（文件数、总大小、最新修改时间），用于判断存储是否过期"""
+    count = 0
+    total_size = 0
+    latest = 0.0
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.txt'):
+                continue
+            stat = entry.stat()
+            count += 1
+            total_size += stat.st_size
+            latest = max(latest, stat.st_mtime)
+    return {"files": count, "bytes": total_size, "mtime": latest}
+
+
+def _valid_row(parts):
+    try:
+        datetime.datetime.strptime(parts[1], "%Y-%m-%d %H:%M:%S")
+        float(parts[2])
+        float(parts[3])
+        return True
+    except ValueError:
+        return False
+
+
+def _rows_to_arrays(rows):
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    _, times, lngs, lats = zip(*rows)
+    return (np.array(times, dtype='datetime64[s]').astype(np.int64),
+            np.array(lngs, dtype=np.float64),
+            np.array(lats, dtype=np.float64))
+
+
+def parse_log_file(filepath):
+    """
+    整体解析一个原始日志文件
+    Args:
+        filepath: 日志文件路径
+    Returns:
+        (epoch, lng, lat): 按时间排序的 int64/float64/float64 数组，无法解析的行被丢弃
+    """
+    with open(filepath, 'r', encoding='utf-8', errors='ignore') as file:
+        rows = [parts for parts in (line.split(',') for line in file) if len(parts) == 4]
+    try:
+        epoch, lng, lat = _rows_to_arrays(rows)
+    except ValueError:
+        # 存在脏数据时退回逐行校验
+        epoch, lng, lat = _rows_to_arrays([parts for parts in rows if _valid_row(parts)])
+
+    order = np.argsort(epoch, kind='stable')
+    return epoch[order], lng[order], lat[order]
+
+
+def _parse_taxi_file(args):
+    taxi_id, filepath = args
+    epoch, lng, lat = parse_log_file(filepath)
+    lng_gcj, lat_gcj = wgs84_to_gcj02_array(lng, lat)
+    return (taxi_id,
+            epoch.astype(np.int32),
+            np.rint(lng * COORD_SCALE).astype(np.int32),
+            np.rint(lat * COORD_SCALE).astype(np.int32),
+            np.rint(lng_gcj * COORD_SCALE).astype(np.int32),
+            np.rint(lat_gcj * COORD_SCALE).astype(np.int32))
+
+
+def list_taxi_files(data_dir):
+    """列出数据目录下的轨迹文件，返回按出租车ID升序的 [(taxi_id, 路径)]"""
+    files = []
+    for filename in os.listdir(data_dir):
+        stem, ext = os.path.splitext(filename)
+        if ext == '.txt' and stem.isdigit():
+            files.append((int(stem), os.path.join(data_dir, filename)))
+    files.sort()
+    return files
+
+
+def build_store(data_dir=DATA_DIR, workers=None):
+    """
+    将原始日志转换为列式存储（一次性导入）
+    Args:
+        data_dir: 原始日志目录
+        workers: 并行解析进程数，默认为CPU核数
+    Returns:
+        str: 存储目录
+    """
+    start_time = time.time()
+    target = store_path(data_dir)
+    signature = source_signature(data_dir)
+    files = list_taxi_files(data_dir)
+
+    taxis, lengths = [], []
+    chunks = {name: [] for name in COLUMNS}
+    with Pool(workers or cpu_count()) as pool:
+        for taxi_id, *columns in pool.imap(_parse_taxi_file, files, chunksize=16):
+            epoch = columns[0]
+            if not len(epoch):
+                continue
+            taxis.append(taxi_id)
+            lengths.append(len(epoch))
+            chunks["taxi_id"].append(np.full(len(epoch), taxi_id, dtype=np.int32))
+            for name, column in zip(COLUMNS[1:], columns):
+                chunks[name].append(column)
+
+    offsets = np.zeros(len(taxis) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    # 先写入临时目录再替换，避免读者看到不完整的存储
+    tmp_dir = target + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name in COLUMNS:
+        column = np.concatenate(chunks[name]) if chunks[name] else np.empty(0, dtype=np.int32)
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), column)
+    np.save(os.path.join(tmp_dir, "taxis.npy"), np.array(taxis, dtype=np.int32))
+    np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+    with open(os.path.join(tmp_dir, "meta.json"), 'w') as f:
+        json.dump({
+            "version": STORE_VERSION,
+            "points": int(offsets[-1]),
+            "taxis": len(taxis),
+            "source": signature
+        }, f)
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_dir, target)
+    print(f"列式存储构建完成：{len(taxis)} 辆车，{int(offsets[-1])} 个点，"
+          f"耗时 {time.time() - start_time:.1f}s -> {target}")
+    return target
+
+
+class TrajectoryStore:
+    """
+    列式轨迹存储的只读视图
+    Attributes:
+        taxi_id, epoch, lng, lat, lng_gcj, lat_gcj: 按出租车、时间排序的 memmap 列
+        taxis: 出租车ID（升序）
+        offsets: 每辆车的起始偏移
+        meta: 存储元数据
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r'))
+        self.taxis = np.load(os.path.join(path, "taxis.npy"))
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def taxi_range(self, taxi_id):
+        """返回某辆车在各列中的 (start, end)，不存在时返回None"""
+        try:
+            taxi_id = int(taxi_id)
+        except (TypeError, ValueError):
+            return None
+        i = int(np.searchsorted(self.taxis, taxi_id))
+        if i >= len(self.taxis) or self.taxis[i] != taxi_id:
+            return None
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def columns(self, start=0, end=None):
+        """
+        读取 [start, end) 范围内的点
+        Returns:
+            (epoch, lng, lat): int64 秒数与 float64 WGS84 经纬度
+        """
+        end = len(self) if end is None else end
+        return (np.asarray(self.epoch[start:end], dtype=np.int64),
+                self.lng[start:end] / COORD_SCALE,
+                self.lat[start:end] / COORD_SCALE)
+
+    def gcj_columns(self, start=0, end=None):
+        """
+        读取 [start, end) 范围内的点（导入时已转换的GCJ02坐标）
+        Returns:
+            (epoch, lng, lat): int64 秒数与 float64 GCJ02 经纬度
+        """
+        end = len(self) if end is None else end
+        return (np.asarray(self.epoch[start:end], dtype=np.int64),
+                self.lng_gcj[start:end] / COORD_SCALE,
+                self.lat_gcj[start:end] / COORD_SCALE)
+
+    def partitions(self, parts, taxis=None):
+        """
+        按出租车边界将所有点划分为约 parts 段点数相近的区间
+        Args:
+            parts: 区间数
+            taxis: 可选，只划分这些车辆（在 taxis 中的下标，升序）；相邻车辆合并为一个区间，
+                   不相邻的车辆各自成段，区间数可能多于 parts
+        Returns:
+            list: [(start, end)]
+        """
+        if taxis is not None:
+            taxis = np.asarray(taxis, dtype=np.int64)
+            if not len(taxis):
+                return []
+            starts, ends = self.offsets[taxis], self.offsets[taxis + 1]
+            sizes = ends - starts
+            limit = max(int(sizes.sum()) / parts, 1)
+            buckets = (np.cumsum(sizes) - sizes) // limit
+            breaks = np.flatnonzero((taxis[1:] != taxis[:-1] + 1) | (buckets[1:] != buckets[:-1])) + 1
+            firsts = np.concatenate(([0], breaks))
+            lasts = np.concatenate((breaks, [len(taxis)])) - 1
+            return [(int(s), int(e)) for s, e in zip(starts[firsts], ends[lasts])]
+        targets = np.linspace(0, len(self), parts + 1)
+        bounds = np.unique(self.offsets[np.searchsorted(self.offsets, targets)])
+        return [(int(s), int(e)) for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
+
+
+def open_store(data_dir=DATA_DIR, build=False):
+    """
+    打开数据目录对应的列式存储
+    Args:
+        data_dir: 原始日志目录
+        build: 存储不存在或源数据已变化时是否重建；只在启动或命令行中使用，请求处理中不重建
+    Returns:
+        TrajectoryStore: 存储视图
+    Raises:
+        FileNotFoundError: 存储不存在或已过期且 build 为False
+    """
+    key = os.path.normpath(data_dir)
+    with _open_lock:
+        if key not in _open_stores:
+            _open_stores[key] = _load_or_build(data_dir, build)
+        return _open_stores[key]
+
+
+def attach_store(path):
+    """
+    按存储目录打开（并缓存）存储视图，供进程池中的工作进程在多次任务间复用 memmap
+    Args:
+        path: 存储目录（TrajectoryStore.path）
+    Returns:
+        TrajectoryStore: 存储视图
+    """
+    with _open_lock:
+        if path not in _attached_stores:
+            _attached_stores[path] = TrajectoryStore(path)
+        return _attached_stores[path]
+
+
+def _load_or_build(data_dir, build):
+    path = store_path(data_dir)
+    meta_file = os.path.join(path, "meta.json")
+    stale = True
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+        stale = (meta.get("version") != STORE_VERSION or
+                 (os.path.isdir(data_dir) and meta.get("source") != source_signature(data_dir)))
+    if stale:
+        if not build:
+            raise FileNotFoundError(f"列式存储不存在或已过期，请先运行 python trajectory_store.py {data_dir}")
+        build_store(data_dir)
+
+    return TrajectoryStore(path)
+
+
+if __name__ == "__main__":
+    build_store(sys.argv[1] if len(sys.argv) > 1 else DATA_DIR)
@@ -0,0 +1,143 @@
+"""
+行程索引模块
+
+对列式存储中的每辆车做行程切分（见 trip_segmentation.segment_trips），记录每个行程的点区间、
+起止时间、起终点与外接矩形，保存在列式存储目录内。A→B 查询先用外接矩形筛出候选行程，
+只读取候选行程的轨迹点确定进入A、到达B的时刻，无需扫描全部数据。
+"""
+
+import os
+import json
+import threading
+import numpy as np
+from service import map_partitions
+from trajectory_store import COORD_SCALE, attach_store, hour_of_day
+from trip_segmentation import segment_trips
+
+TRIP_INDEX_FILE = "trip_index.npz"
+TRIP_INDEX_META_FILE = "trip_index.json"
+TRIP_INDEX_VERSION = 1
+
+# 行程索引的各列：点区间 [start, end)、起止时间、起终点（GCJ02）与外接矩形
+TRIP_FIELDS = ("start", "end", "start_epoch", "end_epoch",
+               "origin_lng", "origin_lat", "dest_lng", "dest_lat",
+               "min_lng", "max_lng", "min_lat", "max_lat")
+
+# 每个进程缓存已加载的行程索引
+_trip_indexes = {}
+_trip_index_lock = threading.Lock()
+
+
+def index_partition(args):
+    """
+    为 [start, end) 区间内的车辆切分行程（在子进程中执行）
+    Returns:
+        dict: 字段名 -> 本区间全部行程的数组，在子进程内汇总后一次性返回
+    """
+    store_dir, start, end = args
+    store = attach_store(store_dir)
+    epoch, lngs, lats = store.gcj_columns(start, end)
+    lo, hi = np.searchsorted(store.offsets, [start, end])
+    bounds = store.offsets[lo:hi + 1] - start
+
+    rows = []
+    for taxi_start, taxi_end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        for s, e in segment_trips(epoch[taxi_start:taxi_end], lngs[taxi_start:taxi_end], lats[taxi_start:taxi_end]):
+            s, e = s + taxi_start, e + taxi_start
+            rows.append((s + start, e + start, epoch[s], epoch[e - 1],
+                         lngs[s], lats[s], lngs[e - 1], lats[e - 1],
+                         lngs[s:e].min(), lngs[s:e].max(), lats[s:e].min(), lats[s:e].max()))
+
+    columns = list(zip(*rows)) if rows else [()] * len(TRIP_FIELDS)
+    return {name: np.array(column, dtype=np.int64 if i < 4 else np.float64)
+            for i, (name, column) in enumerate(zip(TRIP_FIELDS, columns))}
+
+
+def build_trip_index(store):
+    """
+    在常驻进程池中切分全部行程，各进程的结果在主进程中按区间顺序拼接一次
+    Returns:
+        dict: 字段名 -> 数组
+    """
+    # 空存储没有区间，在本进程中切分一个空区间，得到结构相同的空索引
+    parts = map_partitions(index_partition, store) or [index_partition((store.path, 0, 0))]
+    return {name: np.concatenate([part[name] for part in parts]) for name in TRIP_FIELDS}
+
+
+def load_trip_index(store):
+    """
+    读取行程索引，不存在或与存储不一致时重新构建并落盘（每个进程只加载一次）
+    """
+    with _trip_index_lock:
+        if store.path in _trip_indexes:
+            return _trip_indexes[store.path]
+
+        index_file = os.path.join(store.path, TRIP_INDEX_FILE)
+        meta_file = os.path.join(store.path, TRIP_INDEX_META_FILE)
+        expected = {"version": TRIP_INDEX_VERSION, "source": store.meta["source"]}
+        index = None
+        if os.path.exists(index_file) and os.path.exists(meta_file):
+            with open(meta_file) as f:
+                if json.load(f) == expected:
+                    with np.load(index_file) as data:
+                        index = {name: data[name] for name in TRIP_FIELDS}
+        if index is None:
+            index = build_trip_index(store)
+            np.savez(index_file, **index)
+            with open(meta_file, 'w') as f:
+                json.dump(expected, f)
+        _trip_indexes[store.path] = index
+        return index
+
+
+def find_passages(store, index, area1, area2, hour=None):
+    """
+    查找行程中从区域1到区域2的通行：进入区域1的首个点，以及其后到达区域2的首个点
+    Args:
+        store: 列式轨迹存储
+        index: load_trip_index 返回的行程索引
+        area1, area2: (min_lng, max_lng, min_lat, max_lat)，GCJ02坐标
+        hour: 可选，跳过起止时间不覆盖该小时（0-23）的行程；其余行程的通行与不指定时相同，
+              调用方仍需按进入时刻的小时筛选
+    Returns:
+        (entry, exit): 通行起止点在存储中的位置数组，每个行程至多一次通行
+    """
+    def touches(area):
+        min_lng, max_lng, min_lat, max_lat = area
+        return ((index["min_lng"] <= max_lng) & (index["max_lng"] >= min_lng) &
+                (index["min_lat"] <= max_lat) & (index["max_lat"] >= min_lat))
+
+    mask = touches(area1) & touches(area2)
+    if hour is not None:
+        # 行程从起点所在小时开始，跨过 span 个整点
+        span = index["end_epoch"] // 3600 - index["start_epoch"] // 3600
+        mask &= (span >= 23) | ((hour - hour_of_day(index["start_epoch"])) % 24 <= span)
+    candidates = np.flatnonzero(mask)
+    empty = np.zeros(0, dtype=np.int64)
+    if not len(candidates):
+        return empty, empty
+
+    # 展开候选行程的全部点位置
+    starts = index["start"][candidates]
+    lengths = index["end"][candidates] - starts
+    owner = np.repeat(np.arange(len(candidates)), lengths)
+    offsets = np.arange(len(owner)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    positions = starts[owner] + offsets
+    lngs = store.lng_gcj[positions] / COORD_SCALE
+    lats = store.lat_gcj[positions] / COORD_SCALE
+
+    def inside(area):
+        min_lng, max_lng, min_lat, max_lat = area
+        return (min_lng <= lngs) & (lngs <= max_lng) & (min_lat <= lats) & (lats <= max_lat)
+
+    order = np.arange(len(owner))
+    missing = len(owner)
+    entry = np.full(len(candidates), missing)
+    in_area1 = inside(area1)
+    np.minimum.at(entry, owner[in_area1], order[in_area1])
+    arrived = inside(area2) & (order > entry[owner])
+    exit_ = np.full(len(candidates), missing)
+    np.minimum.at(exit_, owner[arrived], order[arrived])
+
+    found = exit_ < missing
+    return positions[entry[found]], positions[exit_[found]]
@@ -0,0 +1,82 @@
+"""
+行程切分模块
+
+将单辆出租车按时间排序的轨迹点切分为若干行程，供频繁路径等分析逐行程处理。
+"""
+
+import numpy as np
+
+# 相邻两点时间间隔超过该值（秒）时视为新行程
+TRIP_GAP_SECONDS = 600
+# 停留检测：连续移动距离均小于 STOP_RADIUS 米且持续不少于 STOP_SECONDS 秒视为停车，行程在此断开
+STOP_RADIUS = 100
+STOP_SECONDS = 300
+# 行程路径编码的网格大小（度）
+PATH_GRID_SIZE = 0.001
+
+EARTH_RADIUS = 6371000  # 地球半径，单位米
+
+
+def segment_trips(epoch, lngs, lats, max_gap=TRIP_GAP_SECONDS,
+                  stop_radius=STOP_RADIUS, stop_seconds=STOP_SECONDS):
+    """
+    结合时间间隔与停留检测切分行程
+    Args:
+        epoch: 单辆车按时间排序的秒数数组
+        lngs: 经度数组
+        lats: 纬度数组
+        max_gap: 行程内相邻两点的最大时间间隔（秒）
+        stop_radius: 停留判定的单步移动距离上限（米）
+        stop_seconds: 停留判定的最短持续时间（秒）
+    Returns:
+        list: 每个行程在数组中的 (start, end) 区间，停留期间的点不属于任何行程
+    """
+    if len(epoch) < 2:
+        return []
+    epoch = np.asarray(epoch, dtype=np.int64)
+    # cut[i] 表示第 i 个点与第 i+1 个点之间的移动不属于行程
+    cut = np.diff(epoch) > max_gap
+    still = np.concatenate(([False], segment_lengths(lngs, lats) < stop_radius, [False]))
+    edges = np.flatnonzero(np.diff(still.astype(np.int8)))
+    for run_start, run_end in zip(edges[::2].tolist(), edges[1::2].tolist()):
+        # 静止段覆盖第 run_start..run_end 个点
+        if epoch[run_end] - epoch[run_start] >= stop_seconds:
+            cut[run_start:run_end] = True
+
+    moving = np.concatenate(([False], ~cut, [False]))
+    edges = np.flatnonzero(np.diff(moving.astype(np.int8)))
+    # 连续的行程移动 start..end-1 覆盖第 start..end 个点
+    return [(start, end + 1) for start, end in zip(edges[::2].tolist(), edges[1::2].tolist())]
+
+
+def encode_cells(lngs, lats, grid_size=PATH_GRID_SIZE):
+    """
+    将行程编码为去除连续重复后的 (lat格, lng格) 序列
+    Returns:
+        bytes: int32 网格序列的紧凑字节表示，可直接作为分组键或存入数据库
+    """
+    cells = np.stack([np.rint(np.asarray(lats) / grid_size), np.rint(np.asarray(lngs) / grid_size)],
+                     axis=1).astype(np.int32)
+    keep = np.concatenate(([True], np.any(cells[1:] != cells[:-1], axis=1)))
+    return cells[keep].tobytes()
+
+
+def segment_lengths(lngs, lats):
+    """
+    计算相邻两点间的Haversine距离
+    Args:
+        lngs: 经度数组
+        lats: 纬度数组
+    Returns:
+        np.ndarray: 长度为 len-1 的距离数组（单位：米）
+    """
+    phi = np.radians(lats)
+    delta_phi = np.diff(phi)
+    delta_lambda = np.radians(np.diff(lngs))
+    a = np.sin(delta_phi / 2) ** 2 + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(delta_lambda / 2) ** 2
+    return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def path_length(lngs, lats):
+    """计算轨迹总长度（单位：米）"""
+    return float(segment_lengths(lngs, lats).sum()) if len(lngs) > 1 else 0.0